@@ -187,6 +187,16 @@ LOGGING = {
 #     'django.contrib.messages.context_processors.messages',
 # )
 
+# Swipes are logged by a write-behind writer (rfid_lock_management/access_log.py):
+# events are journaled to RFID_ACCESS_LOG_JOURNAL (plus a per-process suffix)
+# and written to the database in batches of up to RFID_ACCESS_LOG_BATCH_SIZE,
+# at least every RFID_ACCESS_LOG_FLUSH_INTERVAL seconds. Events that can't be
+# saved end up in RFID_ACCESS_LOG_JOURNAL + '.dead'.
+RFID_ACCESS_LOG_BUFFERED = True
+RFID_ACCESS_LOG_JOURNAL = os.path.join(BASE_DIR, 'access_log.journal')
+RFID_ACCESS_LOG_BATCH_SIZE = 50
+RFID_ACCESS_LOG_FLUSH_INTERVAL = 2.0
+
 # for debug toolbar - requires that the requesting IP address be listed here
 INTERNAL_IPS = ('127.0.0.1', )
 
@@ -37,17 +37,26 @@ urlpatterns = [
        finished_new_keycard_scan),
 
    # Highchart of visitors
+   re_path(r'^chart/data/$', chart_data),
    re_path(r'^chart/', chartify),
 
    # keycard authentication
    re_path(r'checkdoor/(?P<doorid>\d+)/checkrfid/(?P<rfid>\w{10})/$',
        check),
 
+   # controller reconciling swipes it buffered while offline
+   re_path(r'checkdoor/batch/$',
+       check_batch),
+
    # Arduino requesting list of all allowed RFIDs for
    # specified door
    re_path(r'door/(?P<doorid>\d+)/getallowed/$',
        get_allowed_rfids),
 
+   # Gateway requesting the allowed RFIDs of several doors at once
+   re_path(r'doors/getallowed/$',
+       get_allowed_rfids_for_doors),
+
    # Uncomment the admin/doc line below to enable admin documentation:
    # path(r'^admin/doc/',
    # include('django.contrib.admindocs.urls')),
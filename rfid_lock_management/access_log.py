@@ -0,0 +1,408 @@
+"""
+Write-behind logging of keycard swipes.
+
+check() used to build and save an AccessTime inside the request, i.e. one
+(fsync'd, on SQLite) database write per swipe, competing with admin writes for
+the database lock. Instead, swipes are handed to access_time_writer, which
+
+    - appends each event to an on-disk journal (so nothing is lost if the
+      process dies before the event makes it into the database),
+    - keeps it in an in-memory buffer, and
+    - has a background thread write the buffer out with a single bulk_create()
+      once RFID_ACCESS_LOG_BATCH_SIZE events have been queued or
+      RFID_ACCESS_LOG_FLUSH_INTERVAL seconds have passed, after which the
+      journal is truncated.
+
+Every writer (i.e. server process) has its own journal, RFID_ACCESS_LOG_JOURNAL
+with a '.<pid>-<random>' suffix, and holds an exclusive lock on it (on the
+journal's '.lock' file) for as long as it runs. On first use, a writer adopts
+the journals nobody holds the lock of -- those of processes that crashed or
+were killed -- moving their events into its own journal and buffer, so they
+are written out on its next flush. Since a journal is only truncated after
+the database write, a crash between the two means those events are written
+again (unless they have an event_key, see below).
+
+Events that can't be saved because of the data itself (an IntegrityError for
+that one event, e.g. its Door or LockUser has been deleted in the meantime)
+would otherwise be retried forever and hold up all the others; they are moved
+to the dead letter file, RFID_ACCESS_LOG_JOURNAL + '.dead', instead (one JSON
+object per line, with the error added), and logged. Other errors (e.g. the
+database being unreachable) leave the events queued, to be retried.
+
+Denied swipes have no Door/LockUser to attach an AccessTime to (the door may
+not even exist), so they go to the 'rfid_lock_management.access' logger.
+
+Controllers retry on timeouts; events can carry an event_key (see
+make_event_key()), and write() skips events whose key has been saved already,
+so retries -- and events replayed from the journal -- aren't saved twice.
+
+Setting RFID_ACCESS_LOG_BUFFERED to False makes record() save synchronously,
+which is what the tests use.
+"""
+import atexit
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+logger = logging.getLogger('rfid_lock_management.access')
+
+EVENT_KEY_QUERY_BATCH_SIZE = 500
+
+
+def make_event_key(doorid, rfid, timestamp, sequence=''):
+    """
+    Deterministic key identifying one swipe, from what the controller sends
+    along with it (the swipe's timestamp and, optionally, the controller's
+    sequence number), so a retried request can be recognized. The timestamp
+    can't be left out: sequence numbers start over when a controller reboots
+    (or wrap around), so on their own they'd match other swipes.
+    """
+    key = '%s|%s|%s|%s' % (int(doorid), rfid, timestamp, sequence)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def make_event(rfid, doorid, lockuser_id, access_time, event_key=None):
+    """
+    An access event, as journaled and passed to AccessTimeWriter.write().
+    """
+    return {'the_rfid': rfid, 'door_id': int(doorid),
+            'lockuser_id': lockuser_id,
+            'access_time': access_time.isoformat(),
+            'event_key': event_key}
+
+
+class AccessTimeWriter(object):
+    """
+    Buffers access events and writes them to the database in batches.
+    """
+
+    def __init__(self, journal_path=None, batch_size=None,
+                 flush_interval=None):
+        """
+        Defaults come from settings. A flush_interval of 0 means no background
+        thread; the buffer is then only written by calling flush().
+        """
+        # this writer's own journal is journal_base plus a suffix, see
+        # _open_journal()
+        self.journal_base = journal_path or getattr(
+            settings, 'RFID_ACCESS_LOG_JOURNAL',
+            os.path.join(settings.BASE_DIR, 'access_log.journal'))
+        self.dead_letter_path = self.journal_base + '.dead'
+        self.journal_path = None
+        self._journal_lock = None
+        self._pid = None
+        self.batch_size = batch_size or getattr(
+            settings, 'RFID_ACCESS_LOG_BATCH_SIZE', 50)
+        if flush_interval is None:
+            flush_interval = getattr(
+                settings, 'RFID_ACCESS_LOG_FLUSH_INTERVAL', 2.0)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # flush() may be called from the background thread and from atexit
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = None   # loaded from the journals on first use
+        self._thread = None
+
+    def record(self, rfid, doorid, lockuser_id, access_time, granted=True,
+               event_key=None):
+        """
+        Queue one swipe. Returns as soon as the event is journaled.
+        """
+        if not granted:
+            logger.info("Denied rfid %s at door %s at %s", rfid, doorid,
+                        access_time.isoformat())
+            return
+        event = make_event(rfid, doorid, lockuser_id, access_time, event_key)
+
+        if not getattr(settings, 'RFID_ACCESS_LOG_BUFFERED', False):
+            self.write([event])
+            return
+
+        with self._lock:
+            self._load_journal()
+            self._append_to_journal([event])
+            self._buffer.append(event)
+            buffer_full = len(self._buffer) >= self.batch_size
+        self._start_thread()
+        if buffer_full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write all buffered events to the database and truncate the journal
+        accordingly.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._load_journal()
+                events = self._buffer
+                self._buffer = []
+            if not events:
+                return
+            try:
+                self.write(events)
+            except Exception:
+                # E.g. the database is unreachable (events that can't be
+                # saved at all are dead-lettered by write()): put them back,
+                # in front of anything queued in the meantime, and try again
+                # next time; they're still in the journal.
+                with self._lock:
+                    self._buffer = events + self._buffer
+                raise
+            with self._lock:
+                self._rewrite_journal()
+
+    def pending(self):
+        """
+        Number of events not written to the database yet.
+        """
+        with self._lock:
+            self._load_journal()
+            return len(self._buffer)
+
+    def write(self, events):
+        """
+        Save events (see make_event()) to the database right away, bypassing
+        the buffer -- for callers that need to know they've been stored.
+
+        Events with an event_key that has been saved before (i.e. retries)
+        are skipped, events that can't be saved go to the dead letter file.
+        The saved events are added to the hourly rollups (see rollups.py) and
+        their lockusers' last access, in the same transaction.
+        """
+        # imported here, since models.py may end up importing this module
+        from rfid_lock_management.models import AccessTime
+
+        events = self._skip_saved_events(events)
+        if not events:
+            return
+        access_times = []
+        for event in events:
+            at = AccessTime(
+                the_rfid=event['the_rfid'],
+                door_id=event['door_id'],
+                lockuser_id=event['lockuser_id'],
+                event_key=event.get('event_key'),
+                access_time=datetime.datetime.strptime(
+                    event['access_time'], '%Y-%m-%dT%H:%M:%S.%f'
+                    if '.' in event['access_time'] else '%Y-%m-%dT%H:%M:%S'))
+            access_times.append(at)
+        try:
+            self._save(access_times)
+        except IntegrityError:
+            # Someone else saved one of these keys since we looked, or some
+            # event can't be saved at all (foreign keys are only checked on
+            # commit, so we can't tell which one before): save them one by
+            # one, skipping the duplicates and moving the others to the dead
+            # letter file.
+            for event, at in zip(events, access_times):
+                try:
+                    self._save([at])
+                except IntegrityError as e:
+                    if at.event_key and AccessTime.objects.filter(
+                            event_key=at.event_key).exists():
+                        continue   # a duplicate after all
+                    self._dead_letter(event, e)
+
+    def _save(self, access_times):
+        """
+        Insert the AccessTimes and add them to the rollups and their
+        lockusers' last access, all in one transaction.
+        """
+        from rfid_lock_management.models import AccessTime, LockUser
+        from rfid_lock_management.rollups import update_rollups
+
+        with transaction.atomic():
+            # (not save(): the receivers in models.py would add them to the
+            # rollups and last access one by one)
+            AccessTime.objects.bulk_create(access_times)
+            update_rollups(access_times)
+            LockUser.update_last_access(access_times)
+
+    def _skip_saved_events(self, events):
+        """
+        Insert-or-ignore: leave out events whose event_key is already in the
+        database, or appears earlier in events.
+        """
+        from rfid_lock_management.models import AccessTime
+
+        keys = [event['event_key'] for event in events
+                if event.get('event_key')]
+        seen = set()
+        # (in batches, to stay below SQLite's limit on query parameters)
+        for start in range(0, len(keys), EVENT_KEY_QUERY_BATCH_SIZE):
+            seen.update(AccessTime.objects.filter(
+                event_key__in=keys[start:start + EVENT_KEY_QUERY_BATCH_SIZE]
+            ).values_list('event_key', flat=True))
+        new_events = []
+        for event in events:
+            key = event.get('event_key')
+            if key:
+                if key in seen:
+                    continue
+                seen.add(key)
+            new_events.append(event)
+        return new_events
+
+    def close(self):
+        """
+        Give up this writer's journal: remove it if it's empty, otherwise
+        leave it to be adopted by another writer (see _adopt_journals()).
+        Called at exit, after the last flush.
+        """
+        with self._lock:
+            if self._journal_lock is None or self._pid != os.getpid():
+                return
+            if not self._buffer:
+                for path in (self.journal_path, self.journal_path + '.lock'):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self._journal_lock.close()   # releases the lock
+            self._journal_lock = None
+            self._buffer = None
+
+    def _load_journal(self):
+        """
+        On first use (in this process), take a journal of our own and pick
+        up the events in orphaned ones. Must be called with self._lock held.
+        """
+        if self._pid != os.getpid():
+            # first use, or forked since: the journal, lock, buffer and
+            # thread (if any) are the parent's
+            self._pid = os.getpid()
+            self._journal_lock = None
+            self._buffer = None
+            self._thread = None
+        if self._buffer is not None:
+            return
+        self._buffer = []
+        self._open_journal()
+        self._adopt_journals()
+        if self._buffer:
+            logger.info("Recovered %d access events", len(self._buffer))
+
+    def _open_journal(self):
+        self.journal_path = '%s.%d-%s' % (self.journal_base, self._pid,
+                                          uuid.uuid4().hex[:8])
+        self._journal_lock = open(self.journal_path + '.lock', 'a')
+        fcntl.flock(self._journal_lock, fcntl.LOCK_EX)
+        open(self.journal_path, 'a').close()
+
+    def _adopt_journals(self):
+        """
+        Move the events of the journals whose writer is gone (nobody holds
+        their lock) into our journal and buffer. Also picks up the single
+        journal used before there was one per writer.
+        """
+        # one writer adopting at a time
+        with open(self.journal_base + '.lock', 'a') as adopt_lock:
+            fcntl.flock(adopt_lock, fcntl.LOCK_EX)
+            for path in glob.glob(glob.escape(self.journal_base) + '.*'):
+                if path == self.journal_path or \
+                        path.endswith(('.lock', '.tmp', '.dead')):
+                    continue
+                with open(path + '.lock', 'a') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except (IOError, OSError):
+                        continue   # its writer is still running
+                    self._adopt_journal(path)
+                    os.remove(path + '.lock')
+            if os.path.exists(self.journal_base):
+                self._adopt_journal(self.journal_base)
+
+    def _adopt_journal(self, path):
+        events = []
+        try:
+            journal = open(path)
+        except FileNotFoundError:
+            # its writer closed it (see close()) since we globbed
+            return
+        with journal:
+            for line in journal:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # torn write of the last line during a crash
+                    logger.warning("Skipping corrupt access log journal "
+                                   "line: %r", line)
+        if events:
+            # into our journal before the orphaned one is removed
+            self._append_to_journal(events)
+            self._buffer.extend(events)
+            logger.info("Adopted %d access events from %s", len(events),
+                        path)
+        os.remove(path)
+
+    def _append_to_journal(self, events):
+        with open(self.journal_path, 'a') as journal:
+            for event in events:
+                journal.write(json.dumps(event) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _dead_letter(self, event, error):
+        logger.error("Could not save access event %r, moving it to %s: %s",
+                     event, self.dead_letter_path, error)
+        dead_letter = dict(event, error=str(error))
+        with open(self.dead_letter_path, 'a') as dead_letters:
+            fcntl.flock(dead_letters, fcntl.LOCK_EX)
+            dead_letters.write(json.dumps(dead_letter) + '\n')
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+
+    def _rewrite_journal(self):
+        """
+        Replace the journal with the events still buffered. Must be called
+        with self._lock held.
+        """
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as journal:
+            for event in self._buffer:
+                journal.write(json.dumps(event) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(tmp_path, self.journal_path)
+
+    def _start_thread(self):
+        if self._thread is not None or not self.flush_interval:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='AccessTimeWriter')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self._shutdown)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush_quietly()
+
+    def _shutdown(self):
+        self._flush_quietly()
+        self.close()
+
+    def _flush_quietly(self):
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not write access events; will retry")
+        finally:
+            close_old_connections()
+
+
+access_time_writer = AccessTimeWriter()
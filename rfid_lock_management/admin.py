@@ -1,7 +1,11 @@
+import json
 from django.contrib import admin
 from django.forms import CheckboxSelectMultiple, ModelForm
 from django.db import models
-from rfid_lock_management.models import LockUser, AccessTime, RFIDkeycard, Door
+from rfid_lock_management.models import LockUser, AccessTime, RFIDkeycard, Door, \
+    name_key
+from rfid_lock_management.door_permissions import get_manageable_door_ids
+from rfid_lock_management.changelists import AccessTimeChangeList, CURSOR_VAR
 from termcolor import colored
 from django import forms
 from django.contrib import messages
@@ -9,7 +13,13 @@ from django.urls import reverse
 from django.http import HttpResponseRedirect
 from django.contrib.admin import SimpleListFilter
 from django.utils.translation import ugettext_lazy as _
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.urls import path
 
+# number of matches AutocompleteListFilter.search() returns at a time
+FILTER_SEARCH_PAGE_SIZE = 20
 
 
 class LockUserForm(ModelForm):
@@ -98,43 +108,129 @@ class LockUserForm(ModelForm):
                         self.cleaned_data['doors'] = Door.objects.filter(pk=item.pk)
         return self.cleaned_data
 
-class DoorCustomFilter(SimpleListFilter):
-    """ TODO: interim and probably gross way to fix not showing '(None') 
-        in change_list sidebar. And note how similar LockUserFilterWithCustomTemplate is.
+class AutocompleteListFilter(SimpleListFilter):
     """
-    #template = 'custom_list_filter.html'
-
-    # Human-readable title which will be displayed in the
-    # right admin sidebar just above the filter options.
-    title = _('Door')
-
-    # Parameter for the filter that will be used in the URL query.
-    parameter_name = 'door__id__exact'
+    List filter for models with too many objects to link to them all in the
+    change list sidebar: only the selected object is listed, along with a
+    search box that asks AccessTimeAdmin.filter_search_view() for (a page of)
+    the first matching objects.
+
+    Subclasses set model, search_name (which names them in the search URL),
+    label_fields (the fields shown, joined by spaces) and search_ordering
+    (indexed, non-null fields), and may override filter_search().
+    """
+    template = 'admin/rfid_lock_management/autocomplete_list_filter.html'
+    # the change list's page cursor, which choosing an object drops
+    cursor_var = CURSOR_VAR
+    search_name = None
+    label_fields = ()
+    search_ordering = ()
+    model = None
+
+    def has_output(self):
+        # there are no lookups unless something is selected, but the search
+        # box is always shown
+        return True
 
     def lookups(self, request, model_admin):
         """
-        Returns a list of tuples where the first element 
-        is the coded value for the option that will
-        appear in the URL query and the second is the 
-        human-readable name for the option that will appear
-        in the right sidebar.
+        Just the selected object, if any (so that it's shown as selected).
         """
-        doors = Door.objects.all()
-        return [ (door.id, door.name) for door in doors]
+        try:
+            pk = int(self.value())
+        except (TypeError, ValueError):
+            return []
+        return self.get_labels(self.model.objects.filter(pk=pk))
 
     def queryset(self, request, queryset):
         if self.value():
-            return queryset.filter(door__id=self.value())
+            return queryset.filter(**{self.parameter_name: self.value()})
         else:
             return queryset
- 
 
-class LockUserCustomFilter(SimpleListFilter):
-    """ TODO: interim and probably gross way to fix not showing '(None') 
-        in change_list sidebar. And note how similar LockUserFilterWithCustomTemplate is.
-    """
-    #template = 'custom_list_filter.html'
+    @classmethod
+    def get_labels(cls, queryset):
+        return [(row[0], ' '.join(row[1:]))
+                for row in queryset.values_list('pk', *cls.label_fields)]
+
+    @classmethod
+    def filter_search(cls, queryset, term):
+        """
+        The objects whose first label field starts with term.
+        """
+        return queryset.filter(
+            **{cls.label_fields[0] + '__istartswith': term.strip()})
 
+    @classmethod
+    def search(cls, term, after=None, page_size=None):
+        """
+        Return a list of (pk, label) of the first page_size objects matching
+        term, ordered by search_ordering and pk, and a cursor for the next
+        page (None if this is the last one). Pass that cursor as after to get
+        the objects after it (WHERE (search_ordering, pk) > cursor, rather
+        than an OFFSET that reads all the earlier pages again). Raises
+        ValueError for a bad cursor.
+        """
+        page_size = page_size or FILTER_SEARCH_PAGE_SIZE
+        ordering = cls.search_ordering + ('pk', )
+        queryset = cls.filter_search(cls.model.objects.all(), term)
+        if after is not None:
+            queryset = queryset.filter(cls.after_cursor(ordering, after))
+        # one extra row, to tell whether there's another page
+        rows = list(queryset.order_by(*ordering).values_list(
+            *('pk', ) + cls.label_fields + ordering)[:page_size + 1])
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = json.dumps(rows[-1][-len(ordering):])
+        n_labels = len(cls.label_fields)
+        return [(row[0], ' '.join(row[1:1 + n_labels])) for row in rows], \
+            next_cursor
+
+    @staticmethod
+    def prefix_range(field, prefix):
+        """
+        Q for the values of field that start with prefix, as a range (which,
+        unlike LIKE, an index on field serves), plus startswith for
+        collations that don't sort strings by their characters.
+        """
+        if not prefix:
+            return Q()
+        prefix_next = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return Q(**{field + '__gte': prefix, field + '__lt': prefix_next,
+                    field + '__startswith': prefix})
+
+    @staticmethod
+    def after_cursor(ordering, cursor):
+        """
+        Q for the rows after the cursor (the values of the ordering fields of
+        the last row of a page) in that (ascending) order.
+        """
+        values = json.loads(cursor)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError("Not a cursor: %r" % cursor)
+        after = Q()
+        for i, field in enumerate(ordering):
+            after |= Q(**dict(zip(ordering[:i], values[:i]))) & \
+                Q(**{field + '__gt': values[i]})
+        return after
+
+
+class DoorCustomFilter(AutocompleteListFilter):
+    # Human-readable title which will be displayed in the
+    # right admin sidebar just above the filter options.
+    title = _('Door')
+
+    # Parameter for the filter that will be used in the URL query.
+    parameter_name = 'door__id__exact'
+
+    search_name = 'door'
+    model = Door
+    label_fields = ('name', )
+    search_ordering = ('name', )
+
+
+class LockUserCustomFilter(AutocompleteListFilter):
     # Human-readable title which will be displayed in the
     # right admin sidebar just above the filter options.
     title = _('Lock User')
@@ -142,22 +238,23 @@ class LockUserCustomFilter(SimpleListFilter):
     # Parameter for the filter that will be used in the URL query.
     parameter_name = 'lockuser__id__exact'
 
-    def lookups(self, request, model_admin):
+    search_name = 'lockuser'
+    model = LockUser
+    label_fields = ('first_name', 'last_name')
+    search_ordering = ('last_name_key', 'first_name_key')
+
+    @classmethod
+    def filter_search(cls, queryset, term):
         """
-        Returns a list of tuples where the first element 
-        is the coded value for the option that will
-        appear in the URL query and the second is the 
-        human-readable name for the option that will appear
-        in the right sidebar.
+        Every word of term has to start the first or the last name (case
+        insensitively: the lowercased names are indexed, see LockUser.Meta).
         """
-        lock_users = LockUser.objects.all()
-        return [ (lock_user.id, lock_user.first_name + ' ' + lock_user.last_name) for lock_user in lock_users]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(lockuser__id=self.value())
-        else:
-            return queryset
+        for word in term.split():
+            word = name_key(word)
+            queryset = queryset.filter(
+                cls.prefix_range('first_name_key', word) |
+                cls.prefix_range('last_name_key', word))
+        return queryset
 
 
 class LockUserAdmin(admin.ModelAdmin):
@@ -208,6 +305,18 @@ class LockUserAdmin(admin.ModelAdmin):
     )
     list_filter = ('doors', )
 
+    def get_queryset(self, request):
+        """
+        The current RFID, allowed doors and last access columns/fields show
+        the current keycard (and its assigner), the doors and
+        last_access_door's name; fetch them along with the lock users (change
+        list and change form alike), so the change list takes the same number
+        of queries however many rows it shows.
+        """
+        return super(LockUserAdmin, self).get_queryset(request).select_related(
+            'current_keycard__assigner', 'last_access_door').prefetch_related(
+            'doors')
+
     def get_form(self, request, obj=None, **kwargs):
         ModelForm = super(LockUserAdmin, self).get_form(request, obj, **kwargs)
 
@@ -261,14 +370,7 @@ class LockUserAdmin(admin.ModelAdmin):
         if request.user.is_superuser:  # pragma: no cover
             return Door.objects.all()
         # otherwise filter on permissions
-        doors_to_show = Door.objects.none()  # creates an EmptyQuerySet
-        for door in Door.objects.all():
-            # put in proper format for has_perm
-            perm = "rfid_lock_management.can_manage_door_%d" % door.pk
-            if request.user.has_perm(perm):
-                # concatenating QuerySets
-                doors_to_show = doors_to_show | Door.objects.filter(pk=door.pk)
-        return doors_to_show
+        return Door.objects.filter(pk__in=get_manageable_door_ids(request))
 
     # Issue h
     def get_other_doors(self, request, object_id):
@@ -276,28 +378,24 @@ class LockUserAdmin(admin.ModelAdmin):
         Doors that the staff User is not allowed to administer. In change_form
         template, will get a set of these Door objects from context, then check
         the lockuser_set of each to see if the current lockuser has access to
-        it.
+        it. Worked out once per request and lock user (the form and the
+        template both need them).
         """
         #(exclude from coverage report - superuser distinction is a
         # development-only feature)
         if request.user.is_superuser:  # pragma: no cover
             # superuser will always see all doors (doors_to_show)
             return None
-        # otherwise filter on permissions
-        # creates an EmptyQuerySet
-        doors_not_permitted_to_this_staff_user = Door.objects.none()
-        for door in Door.objects.all():
-            # put in proper format for has_perm
-            perm = "rfid_lock_management.can_manage_door_%d" % door.pk
-            if not request.user.has_perm(perm):
-                doors_not_permitted_to_this_staff_user = doors_not_permitted_to_this_staff_user | \
-                    Door.objects.filter(pk=door.pk)  # concatenating QuerySets
-        # all elem that are in this set but not the other. i.e. all doors
-        this_lu = LockUser.objects.get(pk=object_id)
-        ok_for_user_set = set(this_lu.get_allowed_doors())
-        not_for_staff_set = set(doors_not_permitted_to_this_staff_user)
-        doors_not_ok_for_staff = not_for_staff_set.intersection(ok_for_user_set)
-        return doors_not_ok_for_staff
+        other_doors = getattr(request, '_other_doors', None)
+        if other_doors is None:
+            other_doors = request._other_doors = {}
+        object_id = str(object_id)
+        if object_id not in other_doors:
+            # the lock user's doors that are not among the staff user's
+            other_doors[object_id] = set(Door.objects.filter(
+                lockuser__pk=object_id).exclude(
+                pk__in=get_manageable_door_ids(request)))
+        return other_doors[object_id]
 
     def formfield_for_manytomany(self, db_field, request, **kwargs):
         """
@@ -313,7 +411,8 @@ class LockUserAdmin(admin.ModelAdmin):
         return super(LockUserAdmin, self).formfield_for_manytomany(
             db_field, request, **kwargs)
 
-    def change_view(self, request, object_id, form_url='', extra_context=None):
+    def render_change_form(self, request, context, add=False, change=False,
+                           form_url='', obj=None):
         """
         LockUser may have access to Doors that the staff user cannot admin;
         this must be accounted for when determining (Javascript) whether to
@@ -321,12 +420,18 @@ class LockUserAdmin(admin.ModelAdmin):
         all Doors have been unchecked.  In change_form template, will get a set
         of these Door objects from context, then check the lockuser_set of each
         to see if the current lockuser has access to it.
+
+        Whether the lock user has an active keycard is worked out here too,
+        from the object already fetched, rather than by the template (which
+        needs it several times).
         """
-        extra_context = {
+        context.update({
+            "lockuser_has_active_keycard": obj is not None and obj.is_active(),
             "doors_not_permitted_to_this_staff_user":
-            self.get_other_doors(request, object_id)}
-        return super(LockUserAdmin, self).change_view(
-            request, object_id, form_url, extra_context=extra_context)
+            self.get_other_doors(request, obj.pk) if obj is not None else None,
+        })
+        return super(LockUserAdmin, self).render_change_form(
+            request, context, add, change, form_url, obj)
 
     def has_delete_permission(self, request, obj=None):
         """
@@ -373,6 +478,44 @@ class AccessTimeAdmin(admin.ModelAdmin):
     # show filters by RFID and active/inactive on the right
     #list_filter = ('lockuser', 'door')
     list_filter = (DoorCustomFilter, LockUserCustomFilter)
+    # newest first, a page at a time by keyset (see changelists.py); sorting
+    # by other columns would need OFFSET pagination again
+    ordering = ('-access_time', '-pk')
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return AccessTimeChangeList
+
+    def get_urls(self):
+        return [
+            path('filter_search/<str:search_name>/',
+                 self.admin_site.admin_view(self.filter_search_view),
+                 name='rfid_lock_management_accesstime_filter_search'),
+        ] + super(AccessTimeAdmin, self).get_urls()
+
+    def filter_search_view(self, request, search_name):
+        """
+        JSON search endpoint for the AutocompleteListFilters' search boxes:
+        ?term=... gives {"results": [{"id": pk, "text": label}, ...],
+        "next": cursor}, where next (null on the last page) is passed as
+        &after= for the next page.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        for list_filter in self.list_filter:
+            if getattr(list_filter, 'search_name', None) == search_name:
+                break
+        else:
+            raise Http404
+        try:
+            results, next_cursor = list_filter.search(
+                request.GET.get('term', ''), request.GET.get('after') or None)
+        except ValueError:
+            return HttpResponseBadRequest("after must be a cursor from a "
+                                          "previous response")
+        return JsonResponse({
+            'results': [{'id': pk, 'text': text} for pk, text in results],
+            'next': next_cursor})
 
     def changelist_view(self, request, extra_context=None):
         """
@@ -416,9 +559,29 @@ class AccessTimeAdmin(admin.ModelAdmin):
     lockuser_html_heading.short_description = 'User'
     lockuser_html_heading.allow_tags = True
 
+
+class DoorAdmin(admin.ModelAdmin):
+    """
+    Mainly for choosing which staff users and groups manage a Door -- which
+    only superusers may do. Other staff users who may change Doors see the
+    managers read-only; otherwise they could make themselves managers of any
+    Door.
+    """
+    list_display = ('name', 'description')
+    filter_horizontal = ('managers', 'manager_groups')
+    manager_fields = ('managers', 'manager_groups')
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super(DoorAdmin, self).get_readonly_fields(
+            request, obj)
+        if not request.user.is_superuser:
+            readonly_fields = tuple(readonly_fields) + self.manager_fields
+        return readonly_fields
+
 # Register models
 admin.site.register(LockUser, LockUserAdmin)
 admin.site.register(AccessTime, AccessTimeAdmin)
+admin.site.register(Door, DoorAdmin)
 
 # Globally disable deletion of selected objects (i.e this will not be an
 # available action in the Actions dropdown of all ModelAdmins/change_list
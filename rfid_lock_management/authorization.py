@@ -0,0 +1,109 @@
+"""
+Process-wide authorization index for keycard authentication.
+
+Instead of querying keycards, lock users and doors on every swipe, check()
+consults an in-memory mapping of
+
+    rfid -> {lockuser id -> frozenset of allowed door ids}
+
+which only contains active (unrevoked) keycards. The index is built lazily on
+first use and rebuilt whenever it is invalidated. Invalidation happens through
+the signal receivers at the bottom of models.py, which bump the
+'authorization' Generation token in the database; every process reads the
+token (one primary key lookup) before using its index, so a change made in one
+server process (e.g. gunicorn worker) is picked up by all the others.
+
+Note that QuerySet.update() and other bulk operations do not send signals; call
+authorization_index.invalidate() after using them on keycards or doors.
+"""
+import threading
+
+GENERATION_NAME = 'authorization'
+# generation of an index that has to be rebuilt (None is a valid token: not
+# bumped yet)
+STALE = object()
+
+
+class AuthorizationIndex(object):
+    """
+    Lazily built lookup table of which active RFID may open which Door, plus
+    the pk of the latest NewKeycardScan if it is still waiting for a scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = STALE   # generation the index was built for
+        self._rfids = {}
+        self._waiting_scan_pk = None
+
+    def invalidate(self):
+        """
+        Mark the index as stale in this process and, through the database, in
+        all other processes.
+        """
+        # imported here, since models.py imports this module
+        from rfid_lock_management.models import Generation
+
+        Generation.bump(GENERATION_NAME)
+        self._generation = STALE
+
+    def get_lockuser_id(self, rfid, doorid):
+        """
+        Return the pk of the LockUser whose active keycard with this rfid may
+        open the specified door, or None if the rfid is not allowed in.
+        """
+        rfids = self._get_fresh()[0]
+        for lockuser_id, door_ids in rfids.get(rfid, {}).items():
+            if doorid in door_ids:
+                return lockuser_id
+        return None
+
+    def get_waiting_scan_pk(self):
+        """
+        Return the pk of the latest NewKeycardScan if it is waiting for a
+        keycard to be scanned, otherwise None.
+        """
+        return self._get_fresh()[1]
+
+    def _get_fresh(self):
+        from rfid_lock_management.models import Generation
+
+        generation = Generation.get_token(GENERATION_NAME)
+        with self._lock:
+            if self._generation is STALE or self._generation != generation:
+                self._build()
+                # Store the generation read *before* building, so that an
+                # invalidation that happens while we're building is not lost.
+                self._generation = generation
+            return self._rfids, self._waiting_scan_pk
+
+    def _build(self):
+        # imported here, since models.py imports this module
+        from rfid_lock_management.models import (
+            LockUser, NewKeycardScan, RFIDkeycard)
+
+        doors_by_lockuser = {}
+        for lockuser_id, door_id in LockUser.doors.through.objects.values_list(
+                'lockuser_id', 'door_id'):
+            doors_by_lockuser.setdefault(lockuser_id, set()).add(door_id)
+
+        rfids = {}
+        active_keycards = RFIDkeycard.objects.filter(
+            date_revoked=None).values_list('the_rfid', 'lockuser_id')
+        for the_rfid, lockuser_id in active_keycards:
+            # There should only be one active keycard per rfid, but check()
+            # has always allowed for more.
+            rfids.setdefault(the_rfid, {})[lockuser_id] = frozenset(
+                doors_by_lockuser.get(lockuser_id, ()))
+
+        latest_scan = NewKeycardScan.objects.order_by('-pk').values_list(
+            'pk', 'waiting_for_scan').first()
+        waiting_scan_pk = None
+        if latest_scan and latest_scan[1]:
+            waiting_scan_pk = latest_scan[0]
+
+        self._rfids = rfids
+        self._waiting_scan_pk = waiting_scan_pk
+
+
+authorization_index = AuthorizationIndex()
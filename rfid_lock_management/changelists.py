@@ -0,0 +1,165 @@
+"""
+Keyset-paginated change list for AccessTimes.
+
+The standard admin change list counts the (filtered) AccessTimes and fetches
+page N with OFFSET N * list_per_page, i.e. reads every row it skips; both get
+slower with every swipe logged. AccessTimeChangeList instead
+
+    - always orders newest first, on (access_time, pk), which the AccessTime
+      access_time indexes cover,
+    - gets the next (older) page with a cursor holding the last access time
+      and pk shown ("seek" pagination): WHERE (access_time, pk) < cursor
+      ORDER BY ... LIMIT list_per_page + 1, which costs the same however far
+      back the page is, and
+    - estimates the number of access times from the hourly rollups (see
+      rollups.py) when the filters allow it, counting only for combinations
+      the rollups can't answer (both a door and a lock user selected).
+
+The extra row tells whether there is an older page. There are no page
+numbers; the template links to the newest and to the next older page.
+"""
+import datetime
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q, Sum
+
+CURSOR_VAR = 'after'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def make_cursor(access_time, pk):
+    """
+    Cursor for the page of access times older than this one.
+    """
+    delta = access_time - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+    return '%d,%d' % (microseconds, pk)
+
+
+def parse_cursor(cursor):
+    """
+    (access_time, pk) from a cursor made by make_cursor(). Raises ValueError
+    if it isn't one.
+    """
+    microseconds, pk = [int(part) for part in cursor.split(',')]
+    return EPOCH + datetime.timedelta(microseconds=microseconds), pk
+
+
+def estimate_access_time_count(door_id=None, lockuser_id=None, start=None,
+                               end=None):
+    """
+    The number of access times at the door/of the lock user (either or
+    neither, not both) from start up to end (whole hours, both optional),
+    according to the rollups.
+    """
+    # imported here, since models.py may end up importing this module
+    from rfid_lock_management.models import DoorHourlyAccess, \
+        LockUserHourlyAccess
+
+    if lockuser_id is not None:
+        rollups = LockUserHourlyAccess.objects.filter(lockuser_id=lockuser_id)
+    else:
+        rollups = DoorHourlyAccess.objects.all()
+        if door_id is not None:
+            rollups = rollups.filter(door_id=door_id)
+    if start is not None:
+        rollups = rollups.filter(hour__gte=start)
+    if end is not None:
+        rollups = rollups.filter(hour__lt=end)
+    return rollups.aggregate(total=Sum('count'))['total'] or 0
+
+
+class AccessTimeChangeList(ChangeList):
+    """
+    See the module docstring. On top of what ChangeList provides, the
+    template gets newest_url, older_url (None on the last page) and
+    result_count_is_estimate.
+    """
+    # lookups (after the list filters and date hierarchy have taken theirs)
+    # that the rollups can answer
+    ESTIMABLE_LOOKUPS = ('access_time__gte', 'access_time__lt')
+
+    def get_filters_params(self, params=None):
+        # The first use of self.params, which ChangeList.__init__() has just
+        # taken from the query string, dropping PAGE_VAR: drop the cursor as
+        # well, so that get_query_string() links (filters, date hierarchy)
+        # start over from the newest access times. Only older_url adds one
+        # (see get_results()).
+        self.params.pop(CURSOR_VAR, None)
+        return super(AccessTimeChangeList, self).get_filters_params(params)
+
+    def get_filters(self, request):
+        filters = super(AccessTimeChangeList, self).get_filters(request)
+        self.filter_specs_by_parameter = dict(
+            (getattr(spec, 'parameter_name', None), spec)
+            for spec in filters[0])
+        self.remaining_lookup_params = filters[2]
+        return filters
+
+    def get_ordering(self, request, queryset):
+        # (column sorting is off, see AccessTimeAdmin.sortable_by)
+        return ['-access_time', '-pk']
+
+    def get_results(self, request):
+        queryset = self.queryset
+        cursor = request.GET.get(CURSOR_VAR)
+        if cursor:
+            try:
+                access_time, pk = parse_cursor(cursor)
+            except ValueError as e:
+                raise IncorrectLookupParameters(e)
+            queryset = queryset.filter(
+                Q(access_time__lt=access_time) |
+                Q(access_time=access_time, pk__lt=pk))
+        result_list = list(queryset[:self.list_per_page + 1])
+        older_url = None
+        if len(result_list) > self.list_per_page:
+            result_list = result_list[:self.list_per_page]
+            last = result_list[-1]
+            older_url = self.get_query_string(
+                {CURSOR_VAR: make_cursor(last.access_time, last.pk)})
+
+        result_count = self.estimate_count()
+        self.result_count_is_estimate = result_count is not None
+        if result_count is None:
+            result_count = self.queryset.count()
+        elif not cursor:
+            # the rollups may lag behind (see rollups.py)
+            result_count = max(result_count, len(result_list))
+
+        self.result_count = result_count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = bool(cursor or older_url)
+        self.paginator = None
+        self.newest_url = self.get_query_string(remove=[CURSOR_VAR]) \
+            if cursor else None
+        self.older_url = older_url
+
+    def estimate_count(self):
+        """
+        The number of access times matching the filters, from the rollups, or
+        None if they can't tell.
+        """
+        if self.query or set(self.remaining_lookup_params) - set(
+                self.ESTIMABLE_LOOKUPS):
+            return None
+        door_id, lockuser_id = [
+            spec.value() if spec is not None else None
+            for spec in (self.filter_specs_by_parameter.get('door__id__exact'),
+                         self.filter_specs_by_parameter.get(
+                             'lockuser__id__exact'))]
+        if door_id and lockuser_id:
+            return None
+        try:
+            return estimate_access_time_count(
+                door_id=int(door_id) if door_id else None,
+                lockuser_id=int(lockuser_id) if lockuser_id else None,
+                start=self.remaining_lookup_params.get('access_time__gte'),
+                end=self.remaining_lookup_params.get('access_time__lt'))
+        except ValueError:
+            return None
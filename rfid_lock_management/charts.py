@@ -0,0 +1,267 @@
+"""
+Data for the HighCharts (JavaScript) plot of access times (see chart.html):
+one scatter series per door, with the date on the x axis and the time of day
+on the y axis.
+
+Coordinates are computed from the access times themselves, for all points at
+once with NumPy, rather than stored with each AccessTime.
+
+The chart page itself only gets the last CHART_INITIAL_DAYS days of access
+times (see get_initial_window()); the rest is fetched from the /chart/data/
+API as the user asks for it. Past a few thousand points a scatter plot is
+both unreadable and a huge payload, so get_chart_data() returns the raw
+points only for windows with at most CHART_MAX_POINTS access times. For
+larger windows it returns, per door, a heatmap matrix of access counts per
+(day, CHART_SLOT_MINUTES slot of the day), with consecutive days merged so
+there are at most CHART_MAX_DAY_BINS rows. The counts per door, day and slot
+come from the database (GROUP BY on the truncated access times), so binning
+reads one row per busy slot rather than every access time. Either way, the
+payload size does not grow with the length of the access log.
+
+Access times without a door (not on any series) are left out.
+
+Points are read in (door, access_time) order, which the index on those
+fields serves directly, a page of CHART_MAX_POINTS at a time: a page that
+doesn't hold all the points of the window comes with a cursor for the next
+one (keyset pagination, so later pages cost the same as the first).
+"""
+import datetime
+import numpy as np
+from django.db.models import Case, Count, IntegerField, Max, Q, Value, When
+from django.db.models.functions import ExtractHour, TruncDate
+from rfid_lock_management.models import AccessTime, Door
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# days of access times the chart page starts out with
+CHART_INITIAL_DAYS = 30
+# most access times returned as individual points (per page)
+CHART_MAX_POINTS = 5000
+# binned data: width of a time of day slot, and most rows (of days)
+CHART_SLOT_MINUTES = 15
+CHART_MAX_DAY_BINS = 200
+
+
+def get_chart_coordinates(access_times):
+    """
+    Split a sequence of datetimes into chart coordinates. Returns two int64
+    arrays:
+        x: the date, as milliseconds since the epoch (at midnight)
+        y: the time of day, as milliseconds since midnight
+    The datetimes are read as UTC, like JavaScript's Date.UTC() would.
+    """
+    ms = np.array(access_times, dtype='datetime64[ms]').astype(np.int64)
+    y = np.mod(ms, MS_PER_DAY)
+    x = ms - y
+    return x, y
+
+
+def make_chart_points(rows, quote_user=True):
+    """
+    Turn (access_time, lockuser first name, lockuser last name) rows into
+    HighCharts data points. The user names are quoted for chart.html's
+    fix_json_string filter, unless quote_user is False.
+    """
+    if not rows:
+        return []
+    access_times, first_names, last_names = zip(*rows)
+    x, y = get_chart_coordinates(access_times)
+    user_format = '"%s %s"' if quote_user else '%s %s'
+    return [{'x': x_coord, 'y': y_coord,
+             'user': user_format % (first_name or '', last_name or '')}
+            for x_coord, y_coord, first_name, last_name in zip(
+                x.tolist(), y.tolist(), first_names, last_names)]
+
+
+def ms_to_datetime(ms):
+    """
+    Chart coordinate (milliseconds since the epoch) to a (naive) datetime.
+    """
+    return EPOCH + datetime.timedelta(milliseconds=ms)
+
+
+def bin_access_times(door_indexes, x, slots, counts, n_doors, start,
+                     bin_days):
+    """
+    Add up access counts per door, per bin of bin_days days starting at start
+    (in ms, at midnight), per CHART_SLOT_MINUTES slot of the day. For each
+    count, x is its day (as returned by get_chart_coordinates()), slots its
+    slot of the day and door_indexes the index of its door (0 to
+    n_doors - 1).
+
+    Returns an int64 array of shape (n_doors, number of day bins, slots per
+    day).
+    """
+    n_slots = MS_PER_DAY // (CHART_SLOT_MINUTES * 60 * 1000)
+    bin_ms = bin_days * MS_PER_DAY
+    day_bins = (x - start) // bin_ms
+    n_day_bins = int(day_bins.max()) + 1 if len(day_bins) else 0
+    # one flat index per count, so a single bincount does all doors
+    cells = ((door_indexes * n_day_bins + day_bins) * n_slots + slots)
+    binned = np.bincount(cells, weights=counts,
+                         minlength=n_doors * n_day_bins * n_slots)
+    return binned.astype(np.int64).reshape(n_doors, n_day_bins, n_slots)
+
+
+def get_slot_expression():
+    """
+    Database expression for the CHART_SLOT_MINUTES slot of the day of an
+    access time (0 for the first).
+    """
+    slots_per_hour = 60 // CHART_SLOT_MINUTES
+    slot_of_hour = Case(
+        *[When(access_time__minute__lt=(i + 1) * CHART_SLOT_MINUTES,
+               then=Value(i)) for i in range(slots_per_hour - 1)],
+        default=Value(slots_per_hour - 1), output_field=IntegerField())
+    return ExtractHour('access_time') * slots_per_hour + slot_of_hour
+
+
+def get_initial_window():
+    """
+    (start, end) of the window the chart page starts out with: the
+    CHART_INITIAL_DAYS days up to the latest access time, or (None, None) if
+    there are no access times.
+    """
+    latest = AccessTime.objects.aggregate(latest=Max('access_time'))['latest']
+    if latest is None:
+        return None, None
+    end = latest.replace(hour=0, minute=0, second=0, microsecond=0) + \
+        datetime.timedelta(days=1)
+    return end - datetime.timedelta(days=CHART_INITIAL_DAYS), end
+
+
+def make_cursor(door_id, access_time, pk):
+    """
+    Cursor for the page of points after this access time (see
+    get_chart_data()).
+    """
+    delta = access_time - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+    return '%d,%d,%d' % (door_id, microseconds, pk)
+
+
+def parse_cursor(cursor):
+    """
+    (door_id, access_time, pk) from a cursor made by make_cursor(). Raises
+    ValueError if it isn't one.
+    """
+    door_id, microseconds, pk = [int(part) for part in cursor.split(',')]
+    return (door_id, EPOCH + datetime.timedelta(microseconds=microseconds),
+            pk)
+
+
+def get_chart_data(door_ids=None, start=None, end=None, after=None,
+                   points_only=False):
+    """
+    Chart data for the access times at the doors with door_ids (None for all
+    doors) from start up to (not including) end, both datetimes or None for
+    no limit. Returns either
+
+        {'mode': 'points',
+         'series': [{'door_id': 1, 'name': 'Space 1',
+                     'data': [{'x': ..., 'y': ..., 'user': ...}, ...]},
+                    ...],
+         'next': <cursor, or None if this was the last page>,
+         'earlier': <ms, or None>}
+
+    where, on the last page of a window with a start, earlier is the end (the
+    midnight after) of the latest day before start with access times, i.e.
+    where to fetch earlier ones up to -- None if there aren't any (or this
+    isn't the last page).
+
+    or, if there are more than CHART_MAX_POINTS access times (and neither
+    points_only nor a cursor from a previous page, after, is given),
+
+        {'mode': 'bins', 'start': <ms>, 'bin_days': 3, 'slot_minutes': 15,
+         'series': [{'door_id': 1, 'name': 'Space 1',
+                     'counts': [[<count per slot>, ...],   # per day bin
+                                ...]},
+                    ...]}
+
+    where day bin i covers bin_days days from start + i * bin_days days.
+    """
+    doors = Door.objects.order_by('pk')
+    access_times = AccessTime.objects.filter(access_time__isnull=False,
+                                             door__isnull=False)
+    if door_ids is not None:
+        doors = doors.filter(pk__in=door_ids)
+        access_times = access_times.filter(door_id__in=door_ids)
+    earlier_access_times = access_times
+    if start is not None:
+        access_times = access_times.filter(access_time__gte=start)
+    if end is not None:
+        access_times = access_times.filter(access_time__lt=end)
+    doors = list(doors.values_list('pk', 'name'))
+
+    if after is None and not points_only and \
+            access_times.count() > CHART_MAX_POINTS:
+        return get_binned_chart_data(doors, access_times)
+
+    if after is not None:
+        door_id, access_time, pk = parse_cursor(after)
+        access_times = access_times.filter(
+            Q(door_id__gt=door_id) |
+            Q(door_id=door_id, access_time__gt=access_time) |
+            Q(door_id=door_id, access_time=access_time, pk__gt=pk))
+    rows = list(access_times.order_by('door_id', 'access_time', 'pk')
+                .values_list('door_id', 'access_time', 'pk',
+                             'lockuser__first_name', 'lockuser__last_name')
+                [:CHART_MAX_POINTS + 1])
+    next_cursor = None
+    if len(rows) > CHART_MAX_POINTS:
+        rows = rows[:CHART_MAX_POINTS]
+        next_cursor = make_cursor(*rows[-1][:3])
+    earlier = None
+    if next_cursor is None and start is not None:
+        latest = earlier_access_times.filter(access_time__lt=start).aggregate(
+            latest=Max('access_time'))['latest']
+        if latest is not None:
+            day_end = latest.replace(
+                hour=0, minute=0, second=0,
+                microsecond=0) + datetime.timedelta(days=1)
+            earlier = int(get_chart_coordinates([day_end])[0][0])
+    points_by_door = {}
+    for door_id, access_time, pk, first_name, last_name in rows:
+        points_by_door.setdefault(door_id, []).append(
+            (access_time, first_name, last_name))
+    return {'mode': 'points',
+            'series': [{'door_id': door_id, 'name': name,
+                        'data': make_chart_points(
+                            points_by_door.get(door_id, []),
+                            quote_user=False)}
+                       for door_id, name in doors],
+            'next': next_cursor,
+            'earlier': earlier}
+
+
+def get_binned_chart_data(doors, access_times):
+    """
+    The 'bins' mode data of get_chart_data(), for the access_times queryset
+    and the doors' (pk, name) pairs.
+    """
+    cells = list(access_times.annotate(
+        day=TruncDate('access_time'), slot=get_slot_expression()).values_list(
+        'door_id', 'day', 'slot').annotate(count=Count('pk')).order_by())
+    if not cells:
+        return {'mode': 'bins', 'start': None, 'bin_days': 1,
+                'slot_minutes': CHART_SLOT_MINUTES,
+                'series': [{'door_id': door_id, 'name': name, 'counts': []}
+                           for door_id, name in doors]}
+    door_ids, days, slots, cell_counts = zip(*cells)
+    x = np.array(days, dtype='datetime64[D]').astype(
+        'datetime64[ms]').astype(np.int64)
+    first_day = int(x.min())
+    n_days = (int(x.max()) - first_day) // MS_PER_DAY + 1
+    bin_days = -(-n_days // CHART_MAX_DAY_BINS)   # rounded up
+    door_pks = np.array([door_id for door_id, name in doors], dtype=np.int64)
+    counts = bin_access_times(
+        np.searchsorted(door_pks, np.array(door_ids, dtype=np.int64)),
+        x, np.array(slots, dtype=np.int64), np.array(cell_counts),
+        len(doors), first_day, bin_days)
+    return {'mode': 'bins', 'start': first_day, 'bin_days': bin_days,
+            'slot_minutes': CHART_SLOT_MINUTES,
+            'series': [{'door_id': door_id, 'name': name,
+                        'counts': counts[i].tolist()}
+                       for i, (door_id, name) in enumerate(doors)]}
@@ -0,0 +1,87 @@
+"""
+Which Doors a staff user may manage.
+
+Staff users manage the Doors they are one of the managers of (Door.managers),
+directly or through one of their groups (Door.manager_groups); superusers
+manage all Doors. The admin needs this on every page (the doors on the
+LockUser change form, the doors the lock user has that the staff user can't
+manage, the "Doors you manage" navbar), so get_manageable_door_ids() works it
+out with one query and remembers the result for the rest of the request.
+
+The navbar is on every admin page, so get_manageable_doors() also keeps each
+staff user's doors in Django's cache between requests. The entries are keyed
+on the user's is_active and is_superuser and on the 'door_managers'
+Generation token (see models.py), which the signal receivers at the bottom of
+models.py bump whenever a Door, its managers, a group or a user's groups
+change. The token is kept in the database, so a change made in one server
+process is seen by all of them, whatever cache backend is configured. (As
+with the authorization index, QuerySet.update() and other bulk operations
+don't send signals; call invalidate_manageable_doors() after using them.)
+
+(Door management used to be a can_manage_door_<door pk> Permission per Door;
+migration 0011 converts those.)
+"""
+from django.core.cache import cache
+
+GENERATION_NAME = 'door_managers'
+MANAGEABLE_DOORS_CACHE_KEY = 'rfid_lock_management:manageable_doors:%s:%d:%d%d'
+
+
+def query_manageable_door_ids(user):
+    """
+    Return the set of pks of the Doors user may manage.
+    """
+    # imported here, since models.py may end up importing this module
+    from rfid_lock_management.models import Door
+
+    if not user.is_active:
+        return set()
+    if user.is_superuser:
+        return set(Door.objects.values_list('pk', flat=True))
+    # both sides are lookups on the through tables' (indexed) foreign keys
+    by_user = Door.managers.through.objects.filter(
+        user=user).values_list('door_id', flat=True)
+    by_group = Door.manager_groups.through.objects.filter(
+        group__user=user).values_list('door_id', flat=True)
+    return set(by_user.union(by_group))
+
+
+def get_manageable_door_ids(request):
+    """
+    Like query_manageable_door_ids() for request.user, but only queried once
+    per request.
+    """
+    door_ids = getattr(request, '_manageable_door_ids', None)
+    if door_ids is None:
+        door_ids = frozenset(query_manageable_door_ids(request.user))
+        request._manageable_door_ids = door_ids
+    return door_ids
+
+
+def get_manageable_doors(user):
+    """
+    Return a list of (pk, name) of the Doors user may manage, in pk order,
+    from the cache if possible.
+    """
+    # imported here, since models.py may end up importing this module
+    from rfid_lock_management.models import Door, Generation
+
+    cache_key = MANAGEABLE_DOORS_CACHE_KEY % (
+        Generation.get_token(GENERATION_NAME), user.pk, user.is_active,
+        user.is_superuser)
+    doors = cache.get(cache_key)
+    if doors is None:
+        doors = list(Door.objects.filter(
+            pk__in=query_manageable_door_ids(user)).order_by('pk').values_list(
+            'pk', 'name'))
+        cache.set(cache_key, doors)
+    return doors
+
+
+def invalidate_manageable_doors():
+    """
+    Forget all staff users' cached doors (see get_manageable_doors()).
+    """
+    from rfid_lock_management.models import Generation
+
+    Generation.bump(GENERATION_NAME)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from rfid_lock_management.models import LockUser
+
+
+class Command(BaseCommand):
+    help = ("Recompute every LockUser's last_access_time and last_access_door "
+            "from their AccessTimes, e.g. after loading access times with "
+            "loaddata.")
+
+    def handle(self, *args, **options):
+        updated = LockUser.refresh_last_access()
+        self.stdout.write("Updated the last access of %d lock users." %
+                          updated)
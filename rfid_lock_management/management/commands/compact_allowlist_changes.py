@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from rfid_lock_management.models import AllowlistChange, Door
+
+
+class Command(BaseCommand):
+    help = ("Delete old AllowlistChange entries, keeping the last KEEP "
+            "allowlist versions of each door. Controllers that are further "
+            "behind get the full list on their next sync.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=1000,
+                            help="number of versions to keep (default 1000)")
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for door_id, version in Door.objects.values_list(
+                'pk', 'allowlist_version'):
+            deleted += AllowlistChange.objects.filter(
+                door_id=door_id,
+                version__lte=version - options['keep']).delete()[0]
+        self.stdout.write("Deleted %d allowlist change entries." % deleted)
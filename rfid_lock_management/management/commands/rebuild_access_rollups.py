@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from rfid_lock_management.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ("Recompute the hourly access rollups (DoorHourlyAccess, "
+            "LockUserHourlyAccess) from all AccessTimes. Run it once to fill "
+            "them in for existing access times, or after deleting some.")
+
+    def handle(self, *args, **options):
+        created = rebuild_rollups()
+        self.stdout.write("Created %d hourly access rollups." % created)
@@ -0,0 +1,83 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessTime',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('the_rfid', models.CharField(max_length=10, null=True)),
+                ('access_time', models.DateTimeField(null=True)),
+                ('data_point', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Door',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('description', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LockUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=50)),
+                ('last_name', models.CharField(max_length=50)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('address', models.CharField(blank=True, max_length=100)),
+                ('phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                ('birthdate', models.DateField(null=True)),
+                ('deactivate_current_keycard', models.BooleanField(default=False, help_text='Revoke keycard access and deactivate user.')),
+                ('current_keycard_revoker', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL)),
+                ('doors', models.ManyToManyField(blank=True, help_text='Select at least one space to activate keycard.', to='rfid_lock_management.Door')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NewKeycardScan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_initiated', models.DateTimeField(auto_now_add=True)),
+                ('waiting_for_scan', models.BooleanField(default=True)),
+                ('doorid', models.CharField(max_length=50)),
+                ('rfid', models.CharField(max_length=10)),
+                ('ready_to_assign', models.BooleanField(default=False)),
+                ('assigner_user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RFIDkeycard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('the_rfid', models.CharField(editable=False, max_length=10)),
+                ('date_revoked', models.DateTimeField(blank=True, null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('assigner', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='RFIDkeycard_assigned', to=settings.AUTH_USER_MODEL)),
+                ('lockuser', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='rfid_lock_management.LockUser')),
+                ('revoker', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='RFIDkeycard_revoked', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='accesstime',
+            name='door',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='rfid_lock_management.Door'),
+        ),
+        migrations.AddField(
+            model_name='accesstime',
+            name='lockuser',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='rfid_lock_management.LockUser'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='door',
+            name='allowlist_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0002_door_allowlist_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllowlistChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('the_rfid', models.CharField(max_length=10)),
+                ('added', models.BooleanField()),
+                ('door', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rfid_lock_management.Door')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='allowlistchange',
+            index=models.Index(fields=['door', 'version'], name='rfid_lock_m_door_id_4f435b_idx'),
+        ),
+    ]
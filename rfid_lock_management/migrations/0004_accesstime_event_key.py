@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0003_allowlistchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesstime',
+            name='event_key',
+            field=models.CharField(editable=False, max_length=40, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0004_accesstime_event_key'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='accesstime',
+            name='data_point',
+        ),
+    ]
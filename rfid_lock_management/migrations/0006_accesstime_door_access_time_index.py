@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0005_remove_accesstime_data_point'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accesstime',
+            index=models.Index(fields=['door', 'access_time'], name='rfid_lock_m_door_id_548c61_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0006_accesstime_door_access_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoorHourlyAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('first_access', models.DateTimeField()),
+                ('last_access', models.DateTimeField()),
+                ('door', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rfid_lock_management.Door')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LockUserHourlyAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('first_access', models.DateTimeField()),
+                ('last_access', models.DateTimeField()),
+                ('lockuser', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rfid_lock_management.LockUser')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='lockuserhourlyaccess',
+            index=models.Index(fields=['hour'], name='rfid_lock_m_hour_463285_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lockuserhourlyaccess',
+            unique_together={('lockuser', 'hour')},
+        ),
+        migrations.AddIndex(
+            model_name='doorhourlyaccess',
+            index=models.Index(fields=['hour'], name='rfid_lock_m_hour_66c254_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='doorhourlyaccess',
+            unique_together={('door', 'hour')},
+        ),
+    ]
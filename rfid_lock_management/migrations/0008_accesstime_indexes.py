@@ -0,0 +1,21 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0007_hourly_access_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accesstime',
+            index=models.Index(fields=['lockuser', 'access_time'], name='rfid_lock_m_lockuse_7d8765_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accesstime',
+            index=models.Index(fields=['access_time'], name='rfid_lock_m_access__de96bd_idx'),
+        ),
+    ]
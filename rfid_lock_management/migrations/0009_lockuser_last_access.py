@@ -0,0 +1,24 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0008_accesstime_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lockuser',
+            name='last_access_door',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rfid_lock_management.Door'),
+        ),
+        migrations.AddField(
+            model_name='lockuser',
+            name='last_access_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
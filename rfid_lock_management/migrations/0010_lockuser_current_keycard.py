@@ -0,0 +1,45 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_current_keycards(apps, schema_editor):
+    LockUser = apps.get_model('rfid_lock_management', 'LockUser')
+    RFIDkeycard = apps.get_model('rfid_lock_management', 'RFIDkeycard')
+    active_keycards = RFIDkeycard.objects.filter(
+        lockuser=models.OuterRef('pk'), date_revoked=None).order_by('-pk')
+    LockUser.objects.update(current_keycard=models.Subquery(
+        active_keycards.values('pk')[:1]))
+
+
+# At most one active (unrevoked) keycard per RFID and per lock user. Django
+# 2.1 can't declare conditional unique constraints, hence the SQL (partial
+# indexes: SQLite 3.8+ and PostgreSQL). Creating them fails if there already
+# are duplicates; revoke the extra keycards first.
+PARTIAL_UNIQUE_INDEXES = [
+    ('rfidkeycard_one_active_per_rfid', 'the_rfid'),
+    ('rfidkeycard_one_active_per_lockuser', 'lockuser_id'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0009_lockuser_last_access'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lockuser',
+            name='current_keycard',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rfid_lock_management.RFIDkeycard'),
+        ),
+        migrations.RunPython(set_current_keycards, migrations.RunPython.noop),
+    ] + [
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX %s ON rfid_lock_management_rfidkeycard '
+            '(%s) WHERE date_revoked IS NULL' % (name, column),
+            'DROP INDEX %s' % name)
+        for name, column in PARTIAL_UNIQUE_INDEXES
+    ]
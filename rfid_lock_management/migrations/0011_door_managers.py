@@ -0,0 +1,67 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Door management used to be a Permission per Door, created in Door.save()
+DOOR_PERMISSION_PREFIX = 'can_manage_door_'
+
+
+def convert_door_permissions(apps, schema_editor):
+    """
+    Make the users and groups holding a door's can_manage_door_<pk>
+    permission its managers, and delete the permissions.
+    """
+    Door = apps.get_model('rfid_lock_management', 'Door')
+    Permission = apps.get_model('auth', 'Permission')
+    permissions = Permission.objects.filter(
+        content_type__app_label='rfid_lock_management',
+        codename__startswith=DOOR_PERMISSION_PREFIX)
+    for permission in permissions:
+        try:
+            door = Door.objects.get(
+                pk=int(permission.codename[len(DOOR_PERMISSION_PREFIX):]))
+        except (ValueError, Door.DoesNotExist):
+            continue
+        door.managers.add(*permission.user_set.all())
+        door.manager_groups.add(*permission.group_set.all())
+    permissions.delete()
+
+
+def restore_door_permissions(apps, schema_editor):
+    Door = apps.get_model('rfid_lock_management', 'Door')
+    Permission = apps.get_model('auth', 'Permission')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type, _ = ContentType.objects.get_or_create(
+        app_label='rfid_lock_management', model='door')
+    for door in Door.objects.all():
+        permission, _ = Permission.objects.get_or_create(
+            codename='%s%d' % (DOOR_PERMISSION_PREFIX, door.pk),
+            content_type=content_type,
+            defaults={'name': 'Can manage door to %s' % door.name})
+        permission.user_set.add(*door.managers.all())
+        permission.group_set.add(*door.manager_groups.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0009_alter_user_last_name_max_length'),
+        ('rfid_lock_management', '0010_lockuser_current_keycard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='door',
+            name='manager_groups',
+            field=models.ManyToManyField(blank=True, related_name='managed_doors', to='auth.Group'),
+        ),
+        migrations.AddField(
+            model_name='door',
+            name='managers',
+            field=models.ManyToManyField(blank=True, related_name='managed_doors', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(convert_door_permissions,
+                             restore_door_permissions),
+    ]
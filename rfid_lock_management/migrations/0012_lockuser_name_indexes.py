@@ -0,0 +1,21 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0011_door_managers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lockuser',
+            index=models.Index(fields=['last_name', 'first_name'], name='rfid_lock_m_last_na_679cd9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockuser',
+            index=models.Index(fields=['first_name', 'last_name'], name='rfid_lock_m_first_n_bec995_idx'),
+        ),
+    ]
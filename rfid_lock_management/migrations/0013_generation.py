@@ -0,0 +1,22 @@
+# Generated by Django 2.1.5 on 2026-10-18 06:46
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0012_lockuser_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('token', models.UUIDField(default=uuid.uuid4)),
+            ],
+        ),
+    ]
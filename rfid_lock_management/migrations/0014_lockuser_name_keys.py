@@ -0,0 +1,49 @@
+# Generated by Django 2.1.5 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+def set_name_keys(apps, schema_editor):
+    LockUser = apps.get_model('rfid_lock_management', 'LockUser')
+    for lockuser in LockUser.objects.only('first_name', 'last_name'):
+        # (as models.name_key())
+        lockuser.first_name_key = lockuser.first_name.lower()[:50]
+        lockuser.last_name_key = lockuser.last_name.lower()[:50]
+        lockuser.save(update_fields=['first_name_key', 'last_name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfid_lock_management', '0013_generation'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lockuser',
+            name='rfid_lock_m_last_na_679cd9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='lockuser',
+            name='rfid_lock_m_first_n_bec995_idx',
+        ),
+        migrations.AddField(
+            model_name='lockuser',
+            name='first_name_key',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='lockuser',
+            name='last_name_key',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(set_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lockuser',
+            index=models.Index(fields=['last_name_key', 'first_name_key'], name='rfid_lock_m_last_na_df38eb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockuser',
+            index=models.Index(fields=['first_name_key', 'last_name_key'], name='rfid_lock_m_first_n_d79066_idx'),
+        ),
+    ]
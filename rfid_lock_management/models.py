@@ -5,9 +5,15 @@ from django.contrib.auth import models as auth_models
 from django.contrib.auth.management.commands import createsuperuser as create_superuser
 from django.db.models import signals
 import datetime
+import uuid
 from termcolor import colored   # temp
-from django.contrib.contenttypes.models import ContentType
-from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from rfid_lock_management.authorization import authorization_index
+from rfid_lock_management.door_permissions import invalidate_manageable_doors
+
+ALLOWLIST_CACHE_KEY = 'rfid_lock_management:allowlist:%d:%d'
 
 
 class Door(models.Model):
@@ -16,6 +22,14 @@ class Door(models.Model):
     """
     name = models.CharField(max_length=50, unique=True, null=False)
     description = models.TextField(null=True, blank=True)
+    # Bumped whenever the list of RFIDs allowed through this door changes
+    allowlist_version = models.PositiveIntegerField(default=0, editable=False)
+    # Staff users who may manage this door (i.e. give lock users access to
+    # it), directly or through one of their groups (see door_permissions.py)
+    managers = models.ManyToManyField(User, blank=True,
+                                      related_name='managed_doors')
+    manager_groups = models.ManyToManyField(auth_models.Group, blank=True,
+                                            related_name='managed_doors')
 
     def __unicode__(self):
         """
@@ -23,33 +37,128 @@ class Door(models.Model):
         """
         return self.name
 
-    def save(self, *args, **kwargs):
+    def get_allowed_rfids(self):
         """
-        When a new Door is added, create a corresponding Permission, if it does
-        not exist already.
+        Return the RFIDs (strings, sorted) allowed to access this Door.
+
+        The list is cached per allowlist_version, which is bumped (see
+        record_allowlist_changes()) whenever it changes -- so a cached list is
+        never stale, as long as self.allowlist_version is current.
         """
+        cache_key = ALLOWLIST_CACHE_KEY % (self.pk, self.allowlist_version)
+        allowed_rfids = cache.get(cache_key)
+        if allowed_rfids is None:
+            allowed_rfids = self.query_allowed_rfids()
+            cache.set(cache_key, allowed_rfids)
+        return allowed_rfids
 
-        super(Door, self).save(*args, **kwargs)
+    @classmethod
+    def query_allowlists(cls, door_ids):
+        """
+        Like query_allowed_rfids(), for several doors at once, in one query:
+        returns a dict of door pk -> sorted list of RFIDs (doors without any
+        allowed RFIDs are left out).
+        """
+        active_keycards = RFIDkeycard.objects.filter(
+            lockuser__doors__in=list(door_ids), date_revoked=None)
+        allowlists = {}
+        for door_id, the_rfid in active_keycards.values_list(
+                'lockuser__doors', 'the_rfid'):
+            allowlists.setdefault(door_id, set()).add(the_rfid)
+        return dict((door_id, sorted(rfids))
+                    for door_id, rfids in allowlists.items())
 
-        if not Permission.objects.filter(codename='can_manage_door_%d' % self.pk):
-            content_type = ContentType.objects.get(
-                app_label='rfid_lock_management', model='door')
+    def get_allowlist_changes(self, since):
+        """
+        Return the changes to the allowed RFIDs after version since, up to
+        the current allowlist_version, as a sorted list of (rfid, added)
+        tuples -- or None if the change log doesn't go back that far (it's
+        been compacted, or predates the log), in which case the full list is
+        needed.
+        """
+        if since > self.allowlist_version:
+            return None
+        changes = self.allowlistchange_set.filter(
+            version__gt=since, version__lte=self.allowlist_version).order_by(
+            'version', 'pk').values_list('version', 'the_rfid', 'added')
+        net_changes = {}
+        for i, (version, the_rfid, added) in enumerate(changes):
+            # every version has at least one entry, so the first one must be
+            # for the version right after since
+            if i == 0 and version != since + 1:
+                return None
+            # only the last change to each rfid matters
+            net_changes[the_rfid] = added
+        if since < self.allowlist_version and not net_changes:
+            return None
+        return sorted(net_changes.items())
 
-            Permission.objects.create(
-                codename='can_manage_door_%d' % self.pk,
-                name='Can manage door to %s' % self.name,
-                content_type=content_type
-            )
+    def query_allowed_rfids(self):
+        """
+        Get the RFIDs of the active keycards of this Door's lock users from the
+        database, in one query (door -> lockusers -> unrevoked keycards).
+        """
+        return list(self.allowed_rfids_queryset())
 
-    def get_allowed_rfids(self):
+    def allowed_rfids_queryset(self, after=None):
         """
-        Return the RFIDs allowed to access this Door
+        Queryset of the (distinct) RFIDs allowed to access this Door, sorted,
+        optionally only those sorting after the RFID after -- so the list can
+        be read a piece at a time with .iterator() or by slicing it.
         """
-        allowed_rfids = []
-        for lu in self.lockuser_set.all():
-            if lu.get_current_rfid():
-                allowed_rfids.append(lu.get_current_rfid())
-        return allowed_rfids
+        active_keycards = RFIDkeycard.objects.filter(
+            lockuser__doors=self, date_revoked=None)
+        if after is not None:
+            active_keycards = active_keycards.filter(the_rfid__gt=after)
+        return active_keycards.order_by('the_rfid').values_list(
+            'the_rfid', flat=True).distinct()
+
+
+class AllowlistChange(models.Model):
+    """
+    Append-only log of the changes to a Door's list of allowed RFIDs, so door
+    controllers can sync incrementally (see Door.get_allowlist_changes()).
+    Every allowlist_version of a Door after the first logged one has at least
+    one entry. Old entries can be removed with the compact_allowlist_changes
+    management command.
+    """
+    door = models.ForeignKey(Door, on_delete=models.CASCADE)
+    # the Door's allowlist_version this change resulted in
+    version = models.PositiveIntegerField()
+    the_rfid = models.CharField(max_length=10)
+    added = models.BooleanField()   # False: removed
+
+    class Meta:
+        indexes = [models.Index(fields=['door', 'version'])]
+
+    def __unicode__(self):
+        return u'%s%s' % ('+' if self.added else '-', self.the_rfid)
+
+
+class Generation(models.Model):
+    """
+    Identifies the current state of data that server processes keep derived
+    copies of (e.g. the authorization index, see authorization.py): whenever
+    the data changes, bump() replaces the token, and a process whose copy was
+    built for another token rebuilds it. Kept in the database, so that every
+    process sees the change whatever cache backend is configured; random, so
+    that a token never comes back (not even after a rolled back bump()).
+    """
+    name = models.CharField(max_length=50, unique=True)
+    token = models.UUIDField(default=uuid.uuid4)
+
+    @classmethod
+    def get_token(cls, name):
+        """
+        The current token for name, or None if it hasn't been bumped yet.
+        """
+        return cls.objects.filter(name=name).values_list(
+            'token', flat=True).first()
+
+    @classmethod
+    def bump(cls, name):
+        cls.objects.update_or_create(name=name,
+                                     defaults={'token': uuid.uuid4()})
 
 
 class NewKeycardScan(models.Model):
@@ -130,7 +239,20 @@ class AccessTime(models.Model):
     access_time = models.DateTimeField(null=True)    # the time the rfid was used
     lockuser = models.ForeignKey("LockUser", null=True, on_delete=models.PROTECT)
     door = models.ForeignKey("Door", null=True, on_delete=models.PROTECT)
-    data_point = models.TextField()  # Issue #j
+    # Identifies the swipe, so retried requests aren't logged twice (see
+    # access_log.make_event_key())
+    event_key = models.CharField(max_length=40, unique=True, null=True,
+                                 editable=False)
+
+    class Meta:
+        indexes = [
+            # a lock user's (latest) access times
+            models.Index(fields=['lockuser', 'access_time']),
+            # chart data is read by door and time window (see charts.py)
+            models.Index(fields=['door', 'access_time']),
+            # the admin's date hierarchy
+            models.Index(fields=['access_time']),
+        ]
 
     def __unicode__(self):
         #return u'%s' % self.access_time
@@ -149,6 +271,54 @@ class AccessTime(models.Model):
     get_this_lockuser_html.allow_tags = True
 
 
+
+class DoorHourlyAccess(models.Model):
+    """
+    Number of AccessTimes, and the first and last of them, at a Door in one
+    hour -- kept up to date as access times are written (see rollups.py), so
+    reports don't have to scan all AccessTimes.
+    """
+    door = models.ForeignKey(Door, on_delete=models.CASCADE)
+    hour = models.DateTimeField()   # start of the hour
+    count = models.PositiveIntegerField(default=0)
+    first_access = models.DateTimeField()
+    last_access = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('door', 'hour')
+        indexes = [models.Index(fields=['hour'])]
+
+    def __unicode__(self):
+        return u'%s: %d' % (self.hour.strftime("%B %d, %Y, %I %p"),
+                            self.count)
+
+
+class LockUserHourlyAccess(models.Model):
+    """
+    Like DoorHourlyAccess, per LockUser.
+    """
+    lockuser = models.ForeignKey("LockUser", on_delete=models.CASCADE)
+    hour = models.DateTimeField()   # start of the hour
+    count = models.PositiveIntegerField(default=0)
+    first_access = models.DateTimeField()
+    last_access = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('lockuser', 'hour')
+        indexes = [models.Index(fields=['hour'])]
+
+    def __unicode__(self):
+        return u'%s: %d' % (self.hour.strftime("%B %d, %Y, %I %p"),
+                            self.count)
+
+def name_key(name):
+    """
+    The lowercased name stored in LockUser.first_name_key/last_name_key, so
+    that a case-insensitive prefix search is a plain range on an index.
+    """
+    return name.lower()[:50]
+
+
 class LockUser(models.Model):
     """
     (Despite the misleading name, LockUsers are not subclassed Users, but
@@ -156,6 +326,12 @@ class LockUser(models.Model):
     """
     first_name = models.CharField(max_length=50, null=False)
     last_name = models.CharField(max_length=50, null=False)
+    # Lowercased names, for the AccessTime change list's lock user filter:
+    # its prefix search is a range on these (see admin.LockUserCustomFilter)
+    first_name_key = models.CharField(max_length=50, default='',
+                                      editable=False)
+    last_name_key = models.CharField(max_length=50, default='',
+                                     editable=False)
     email = models.EmailField(null=False, unique=True)
     address = models.CharField(max_length=100, blank=True)
     phone_number = models.CharField(max_length=20, null=True, blank=True)
@@ -165,6 +341,32 @@ class LockUser(models.Model):
     deactivate_current_keycard = models.BooleanField(default=False)
     deactivate_current_keycard.help_text = "Revoke keycard access and deactivate user."
     current_keycard_revoker = models.ForeignKey(User, null=True, on_delete=models.PROTECT)
+    # The active (unrevoked) keycard, if any -- maintained by the RFIDkeycard
+    # signal receivers (see update_lockuser_current_keycard())
+    current_keycard = models.ForeignKey(
+        RFIDkeycard, null=True, blank=True, editable=False, related_name='+',
+        on_delete=models.SET_NULL)
+    # Denormalized from AccessTime, for the change list and change form (see
+    # update_last_access())
+    last_access_time = models.DateTimeField(null=True, blank=True,
+                                            editable=False)
+    last_access_door = models.ForeignKey(
+        Door, null=True, blank=True, editable=False, related_name='+',
+        on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            # the AccessTime change list's lock user filter looks up name
+            # prefixes in these, and shows the matches in the first one's
+            # order (see admin.py)
+            models.Index(fields=['last_name_key', 'first_name_key']),
+            models.Index(fields=['first_name_key', 'last_name_key']),
+        ]
+
+    # Kept up to date with queryset updates by signal receivers, so save()
+    # mustn't write back an instance's possibly outdated values
+    MAINTAINED_FIELDS = ('current_keycard', 'last_access_time',
+                         'last_access_door')
 
     def save(self, *args, **kwargs):
         """
@@ -179,6 +381,19 @@ class LockUser(models.Model):
         # when saving RFIDkeycard object, we need to save the LockUser object
         # first, so we can get self.id (which is also necessary before any work
         # with FK's and M2M).
+        self.first_name_key = name_key(self.first_name)
+        self.last_name_key = name_key(self.last_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = list(update_fields) + [
+                name + '_key' for name in ('first_name', 'last_name')
+                if name in update_fields]
+        if not self._state.adding and not args and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.MAINTAINED_FIELDS]
         super(LockUser, self).save(*args, **kwargs)
 
         # Not doing a check for door existence here. At this point,
@@ -218,6 +433,7 @@ class LockUser(models.Model):
             # todo: consider putting the following two statements into
             # deactivate()
             # no current keycard to deactivate anymore
+            self.current_keycard = None
             self.deactivate_current_keycard = False
             self.current_keycard_revoker = None
             self.save()
@@ -257,21 +473,17 @@ class LockUser(models.Model):
     def get_current_rfid(self):
         """
         Of all RFID's associated with this LockUser, get the one that's active,
-        i.e. has not been revoked.
+        i.e. has not been revoked. (There can only be one, see the
+        rfidkeycard_one_active_per_lockuser index.)
         """
-        all_rfid_keycards = self.get_all_rfids()
-        curr_rfid = all_rfid_keycards.filter(date_revoked=None)
-        # There should only be one
-        try:
-            return curr_rfid[0]
-        except:
-            return None
+        return self.current_keycard
 
     def is_active(self):
         """
         Useful in LockUser's list display
         """
-        return self.get_current_rfid() is not None
+        # no need to fetch the keycard
+        return self.current_keycard_id is not None
 
     def prettify_get_current_rfid(self):
         """
@@ -297,9 +509,8 @@ class LockUser(models.Model):
         return self.doors.all()
 
     def prettify_get_allowed_doors(self):
-        allowed_doors = self.get_allowed_doors()
-        door_names_list = allowed_doors.values_list('name', flat=True)
-        return ", ".join(door_names_list)
+        # (iterating rather than values_list(), so prefetched doors are used)
+        return ", ".join(door.name for door in self.get_allowed_doors())
 
     def get_allowed_doors_html_links(self):
         """
@@ -336,13 +547,9 @@ class LockUser(models.Model):
         Same story with current RFID vs previous one as in the
         comment for get_all_access_time().
         """
-        access_times = self.get_all_access_times()
-
-        # grab the last one
-        if access_times:
-            return access_times[-1]
-        else:
-            return None
+        # just the latest one, from the (lockuser, access_time) index
+        return AccessTime.objects.filter(lockuser=self).order_by(
+            '-access_time').values_list('access_time', flat=True).first()
 
     def prettify_get_last_access_time(self):
         last = self.get_last_access_time()
@@ -355,10 +562,13 @@ class LockUser(models.Model):
         """
         Includes the door this access time is associated with (for change list)
         """
-        # todo: note - a different appraoch than similar methods
-        at_query_set = AccessTime.objects.filter(lockuser=self)
-        last = at_query_set.latest('access_time')
-        return last.access_time.strftime("%B %d, %Y, %I:%M %p") + " (" + last.door.name + ")"
+        # From the denormalized fields: no queries, as long as
+        # last_access_door has been select_related()
+        if not self.last_access_time:
+            return None
+        return "%s (%s)" % (
+            self.last_access_time.strftime("%B %d, %Y, %I:%M %p"),
+            self.last_access_door.name if self.last_access_door else '')
 
     def last_access_time_and_link_to_more(self):
         """
@@ -376,24 +586,49 @@ class LockUser(models.Model):
         """
         Including link to all access times (for change form)
         """
-        # todo: note - a different appraoch than similar methods
-        at_query_set = AccessTime.objects.filter(lockuser=self)
-        last = at_query_set.latest('access_time')
-        link = self.all_access_times_link()
-        """
+        last = self.prettify_get_last_access_time_and_door()
         if last:
-            return "%s (%s) (%s)" % (last.access_time.strftime("%B %d, %Y, %I:%M %p"), last.door.name, link)
-        else:
-            return None
-        """
-        # todo (see __B__)
-        return_val = None
-        if last:
-            return_val = "%s (%s) (%s)" % (last.access_time.strftime("%B %d, %Y, %I:%M %p"), last.door.name, link)
-        return return_val
+            return "%s (%s)" % (last, self.all_access_times_link())
+        return None
     last_access_time_and_door_and_link_to_more.allow_tags = True
     last_access_time_and_door_and_link_to_more.short_description = "Last access"
 
+    @classmethod
+    def update_last_access(cls, access_times):
+        """
+        Move the lockusers' last_access_time/last_access_door forward to the
+        latest of these (newly saved) AccessTimes, if it's later: one UPDATE
+        per lockuser.
+        """
+        latest = {}
+        for at in access_times:
+            if at.lockuser_id is None or at.access_time is None:
+                continue
+            if at.lockuser_id not in latest or \
+                    at.access_time >= latest[at.lockuser_id][0]:
+                latest[at.lockuser_id] = (at.access_time, at.door_id)
+        for lockuser_id, (access_time, door_id) in sorted(latest.items()):
+            cls.objects.filter(
+                Q(last_access_time__isnull=True) |
+                Q(last_access_time__lte=access_time),
+                pk=lockuser_id).update(last_access_time=access_time,
+                                       last_access_door=door_id)
+
+    @classmethod
+    def refresh_last_access(cls, lockusers=None):
+        """
+        Recompute last_access_time/last_access_door from the AccessTimes of
+        lockusers (a LockUser queryset; default: all), with one UPDATE.
+        """
+        if lockusers is None:
+            lockusers = cls.objects.all()
+        latest = AccessTime.objects.filter(
+            lockuser=OuterRef('pk'), access_time__isnull=False).order_by(
+            '-access_time', '-pk')
+        return lockusers.update(
+            last_access_time=Subquery(latest.values('access_time')[:1]),
+            last_access_door=Subquery(latest.values('door')[:1]))
+
     def __unicode__(self):
         """ In the list of AccessTimes, for example, LockUsers will be
         represented with their first and last names
@@ -434,3 +669,276 @@ def create_testuser(app, created_models, verbosity, **kwargs):  # pragma: no cov
 signals.post_migrate.connect(
     create_testuser, sender=auth_models,
     dispatch_uid='common.models.create_testuser')
+
+
+####################################################################
+# Keep the keycard authorization index in sync (see authorization.py)
+####################################################################
+def invalidate_authorization_index(sender, **kwargs):
+    authorization_index.invalidate()
+
+for index_sender in (Door, RFIDkeycard, NewKeycardScan):
+    signals.post_save.connect(
+        invalidate_authorization_index, sender=index_sender,
+        dispatch_uid='authorization_index_save_%s' % index_sender.__name__)
+    signals.post_delete.connect(
+        invalidate_authorization_index, sender=index_sender,
+        dispatch_uid='authorization_index_delete_%s' % index_sender.__name__)
+
+signals.m2m_changed.connect(
+    invalidate_authorization_index, sender=LockUser.doors.through,
+    dispatch_uid='authorization_index_lockuser_doors')
+
+
+####################################################################
+# Log changes to doors' allowed RFIDs (and bump Door.allowlist_version)
+####################################################################
+def record_allowlist_changes(door_ids, added=(), removed=()):
+    """
+    Record that the RFIDs in added/removed were added to/removed from the
+    allowlists of the specified doors: each affected Door's allowlist_version
+    is bumped, and AllowlistChange entries are logged for the new version.
+
+    A removal is skipped for doors the RFID is still allowed through (e.g.
+    the card was reassigned, and the new lockuser may use the same door).
+    """
+    door_ids = set(door_ids)
+    if not door_ids or not (added or removed):
+        return
+    still_allowed = set()
+    if removed:
+        still_allowed = set(RFIDkeycard.objects.filter(
+            date_revoked=None, the_rfid__in=removed,
+            lockuser__doors__in=door_ids).values_list(
+                'lockuser__doors', 'the_rfid'))
+
+    changes_by_door = {}
+    for door_id in door_ids:
+        changes = [(rfid, True) for rfid in added]
+        changes += [(rfid, False) for rfid in removed
+                    if (door_id, rfid) not in still_allowed]
+        if changes:
+            changes_by_door[door_id] = changes
+    if not changes_by_door:
+        return
+
+    with transaction.atomic():
+        doors = Door.objects.filter(pk__in=list(changes_by_door))
+        # Note: update() does not call save() or send signals.
+        doors.update(allowlist_version=F('allowlist_version') + 1)
+        versions = dict(doors.values_list('pk', 'allowlist_version'))
+        AllowlistChange.objects.bulk_create([
+            AllowlistChange(door_id=door_id, version=versions[door_id],
+                            the_rfid=rfid, added=added_rfid)
+            for door_id, changes in changes_by_door.items()
+            if door_id in versions   # door may have just been deleted
+            for rfid, added_rfid in changes])
+
+
+def get_active_rfids(lockuser_ids):
+    return list(RFIDkeycard.objects.filter(
+        lockuser__in=list(lockuser_ids), date_revoked=None).values_list(
+            'the_rfid', flat=True))
+
+
+def remember_keycard_state(sender, instance, raw, **kwargs):
+    """
+    Before a keycard is saved, note whether it was active, so that on
+    post_save we know whether it was assigned or revoked.
+    """
+    instance._was_active = instance.pk is not None and \
+        RFIDkeycard.objects.filter(
+            pk=instance.pk, date_revoked=None).exists()
+
+signals.pre_save.connect(
+    remember_keycard_state, sender=RFIDkeycard,
+    dispatch_uid='allowlist_keycard_pre_save')
+
+
+def record_keycard_allowlist_changes(sender, instance, **kwargs):
+    """
+    A keycard was assigned (created), revoked (RFIDkeycard.deactivate(), then
+    saved) or deleted: the doors of its lockuser are affected.
+    """
+    if kwargs.get('raw'):   # loaddata
+        return
+    was_active = getattr(instance, '_was_active', False)
+    is_active = instance.is_active() and 'created' in kwargs   # not deleted
+    if was_active == is_active:
+        return
+    door_ids = instance.lockuser.doors.values_list('pk', flat=True)
+    if is_active:
+        record_allowlist_changes(door_ids, added=[instance.the_rfid])
+    else:
+        record_allowlist_changes(door_ids, removed=[instance.the_rfid])
+
+signals.post_save.connect(
+    record_keycard_allowlist_changes, sender=RFIDkeycard,
+    dispatch_uid='allowlist_keycard_save')
+signals.post_delete.connect(
+    record_keycard_allowlist_changes, sender=RFIDkeycard,
+    dispatch_uid='allowlist_keycard_delete')
+
+
+def record_doors_allowlist_changes(sender, instance, action, reverse, pk_set,
+                                   **kwargs):
+    """
+    Doors were added to or removed from a lockuser (or, from the Door side,
+    lockusers to or from a door).
+    """
+    if reverse:
+        # instance is a Door, pk_set holds lockuser pks
+        if action in ('post_add', 'post_remove'):
+            rfids = get_active_rfids(pk_set)
+        elif action == 'pre_clear':
+            instance._rfids_before_clear = get_active_rfids(
+                instance.lockuser_set.values_list('pk', flat=True))
+            return
+        elif action == 'post_clear':
+            rfids = getattr(instance, '_rfids_before_clear', [])
+        else:
+            return
+        door_ids = [instance.pk]
+    else:
+        # instance is a LockUser, pk_set holds door pks
+        if action == 'pre_clear':
+            # after the clear we won't know which doors were affected anymore
+            instance._doors_before_clear = list(
+                instance.doors.values_list('pk', flat=True))
+            return
+        elif action == 'post_clear':
+            door_ids = getattr(instance, '_doors_before_clear', [])
+        elif action in ('post_add', 'post_remove'):
+            door_ids = pk_set
+        else:
+            return
+        rfids = get_active_rfids([instance.pk])
+
+    if action == 'post_add':
+        record_allowlist_changes(door_ids, added=rfids)
+    else:
+        record_allowlist_changes(door_ids, removed=rfids)
+
+signals.m2m_changed.connect(
+    record_doors_allowlist_changes, sender=LockUser.doors.through,
+    dispatch_uid='allowlist_lockuser_doors')
+
+
+def update_lockuser_last_access(sender, instance, **kwargs):
+    """
+    Keep LockUser.last_access_time/last_access_door up to date for AccessTimes
+    saved or deleted one by one (AccessTimeWriter.write() bulk-saves them and
+    calls LockUser.update_last_access() itself).
+    """
+    if kwargs.get('raw') or instance.lockuser_id is None:   # loaddata
+        return
+    if 'created' in kwargs:
+        LockUser.update_last_access([instance])
+    else:
+        LockUser.refresh_last_access(
+            LockUser.objects.filter(pk=instance.lockuser_id))
+
+signals.post_save.connect(
+    update_lockuser_last_access, sender=AccessTime,
+    dispatch_uid='lockuser_last_access_save')
+signals.post_delete.connect(
+    update_lockuser_last_access, sender=AccessTime,
+    dispatch_uid='lockuser_last_access_delete')
+
+
+def remember_access_time_state(sender, instance, raw, **kwargs):
+    """
+    Before an existing AccessTime is saved, note its door, lockuser and time,
+    so that on post_save the rollups of those can be recomputed too.
+    """
+    instance._before_save = None
+    if not raw and instance.pk is not None:
+        instance._before_save = AccessTime.objects.filter(
+            pk=instance.pk).only('door', 'lockuser', 'access_time').first()
+
+signals.pre_save.connect(
+    remember_access_time_state, sender=AccessTime,
+    dispatch_uid='access_rollups_pre_save')
+
+
+def update_access_rollups(sender, instance, **kwargs):
+    """
+    Keep the hourly access rollups (see rollups.py) up to date for
+    AccessTimes saved or deleted one by one: new ones are added, and the
+    hours of changed or deleted ones are recomputed (AccessTimeWriter.write()
+    bulk-saves them and calls update_rollups() itself).
+    """
+    if kwargs.get('raw'):   # loaddata
+        return
+    # imported here, since rollups.py imports this module
+    from rfid_lock_management.rollups import refresh_rollups, update_rollups
+    if kwargs.get('created'):
+        update_rollups([instance])
+    else:
+        before = getattr(instance, '_before_save', None)
+        refresh_rollups([instance] + ([before] if before else []))
+
+signals.post_save.connect(
+    update_access_rollups, sender=AccessTime,
+    dispatch_uid='access_rollups_save')
+signals.post_delete.connect(
+    update_access_rollups, sender=AccessTime,
+    dispatch_uid='access_rollups_delete')
+
+
+def update_lockuser_current_keycard(sender, instance, **kwargs):
+    """
+    Point the keycard's lockuser's current_keycard at it when it's assigned,
+    and away from it when it's revoked (deleted keycards are taken care of by
+    on_delete=SET_NULL). The lockuser instance the keycard holds, if any, is
+    updated too.
+    """
+    if kwargs.get('raw'):   # loaddata
+        return
+    lockusers = LockUser.objects.filter(pk=instance.lockuser_id)
+    if instance.is_active():
+        lockusers.update(current_keycard=instance)
+        current_keycard = instance
+    else:
+        lockusers.filter(current_keycard=instance).update(
+            current_keycard=None)
+        current_keycard = None
+    if RFIDkeycard._meta.get_field('lockuser').is_cached(instance):
+        lockuser = instance.lockuser
+        if current_keycard is not None or \
+                lockuser.current_keycard_id == instance.pk:
+            lockuser.current_keycard = current_keycard
+
+signals.post_save.connect(
+    update_lockuser_current_keycard, sender=RFIDkeycard,
+    dispatch_uid='lockuser_current_keycard_save')
+
+
+####################################################################
+# Forget staff users' cached doors (see door_permissions.py)
+####################################################################
+def invalidate_cached_manageable_doors(sender, **kwargs):
+    if kwargs.get('raw'):   # loaddata
+        return
+    invalidate_manageable_doors()
+
+# (a user's is_active/is_superuser are part of the cache key instead, so
+# that every login's User save doesn't clear everyone's doors)
+signals.post_save.connect(
+    invalidate_cached_manageable_doors, sender=Door,
+    dispatch_uid='manageable_doors_door_save')
+signals.post_delete.connect(
+    invalidate_cached_manageable_doors, sender=Door,
+    dispatch_uid='manageable_doors_door_delete')
+# (deleting a group deletes its rows in Door.manager_groups and User.groups
+# without sending m2m_changed)
+signals.post_delete.connect(
+    invalidate_cached_manageable_doors, sender=auth_models.Group,
+    dispatch_uid='manageable_doors_group_delete')
+
+for through, through_name in ((Door.managers.through, 'managers'),
+                              (Door.manager_groups.through, 'manager_groups'),
+                              (User.groups.through, 'user_groups')):
+    signals.m2m_changed.connect(
+        invalidate_cached_manageable_doors, sender=through,
+        dispatch_uid='manageable_doors_%s' % through_name)
@@ -0,0 +1,152 @@
+"""
+Hourly access rollups: per Door and per LockUser, the number of AccessTimes
+in each hour, with the first and last of them (DoorHourlyAccess and
+LockUserHourlyAccess).
+
+AccessTimeWriter.write() calls update_rollups() with every batch of access
+times it saves, in the same transaction, so the rollups are kept up to date
+incrementally, and reports (busiest doors, per-hour occupancy, visits per
+lock user) read one row per hour instead of scanning all AccessTimes -- see
+get_door_counts() and get_lockuser_counts().
+
+AccessTimes saved one by one (e.g. in the admin) are added by a post_save
+receiver, and the hours of those changed or deleted are recomputed with
+refresh_rollups() (see models.py). Only queryset update()s and bulk_create()s
+outside AccessTimeWriter bypass the rollups; the rebuild_access_rollups
+management command recomputes them from the AccessTime table (and fills them
+in for existing databases).
+"""
+import datetime
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Greatest, Least, TruncHour
+from rfid_lock_management.models import AccessTime, DoorHourlyAccess, \
+    LockUserHourlyAccess
+
+ROLLUPS = ((DoorHourlyAccess, 'door'), (LockUserHourlyAccess, 'lockuser'))
+
+
+def truncate_to_hour(access_time):
+    return access_time.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_access_times(access_times, field):
+    """
+    Return a dict of (<field>_id, hour) -> [count, first, last] for the
+    AccessTimes (leaving out those without a <field>).
+    """
+    buckets = {}
+    for at in access_times:
+        key_id = getattr(at, field + '_id')
+        if key_id is None or at.access_time is None:
+            continue
+        key = (key_id, truncate_to_hour(at.access_time))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, at.access_time, at.access_time]
+        else:
+            bucket[0] += 1
+            bucket[1] = min(bucket[1], at.access_time)
+            bucket[2] = max(bucket[2], at.access_time)
+    return buckets
+
+
+def add_to_rollup(model, field, buckets):
+    """
+    Add the counts of buckets (see aggregate_access_times()) to model's rows,
+    creating the rows that don't exist yet.
+    """
+    for (key_id, hour), (count, first, last) in sorted(buckets.items()):
+        lookup = {field + '_id': key_id, 'hour': hour}
+        increment = dict(count=F('count') + count,
+                         first_access=Least('first_access', first),
+                         last_access=Greatest('last_access', last))
+        if model.objects.filter(**lookup).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(count=count, first_access=first,
+                                     last_access=last, **lookup)
+        except IntegrityError:
+            # someone else created the row in the meantime
+            model.objects.filter(**lookup).update(**increment)
+
+
+def update_rollups(access_times):
+    """
+    Add newly saved AccessTimes to the hourly rollups.
+    """
+    with transaction.atomic():
+        for model, field in ROLLUPS:
+            add_to_rollup(model, field,
+                          aggregate_access_times(access_times, field))
+
+
+def refresh_rollups(access_times):
+    """
+    Recompute the rollup rows of the doors, lockusers and hours of these
+    AccessTimes from the AccessTime table -- for access times that were
+    changed or deleted, which can't be taken out of the counts incrementally.
+    """
+    with transaction.atomic():
+        for model, field in ROLLUPS:
+            for key_id, hour in sorted(
+                    aggregate_access_times(access_times, field)):
+                lookup = {field + '_id': key_id, 'hour': hour}
+                totals = AccessTime.objects.filter(
+                    access_time__gte=hour,
+                    access_time__lt=hour + datetime.timedelta(hours=1),
+                    **{field + '_id': key_id}).aggregate(
+                    count=Count('pk'), first_access=Min('access_time'),
+                    last_access=Max('access_time'))
+                if totals['count']:
+                    model.objects.update_or_create(defaults=totals, **lookup)
+                else:
+                    model.objects.filter(**lookup).delete()
+
+
+def rebuild_rollups():
+    """
+    Recompute all rollups from the AccessTime table, with one aggregate query
+    per rollup. Returns the number of rollup rows created.
+    """
+    created = 0
+    with transaction.atomic():
+        for model, field in ROLLUPS:
+            model.objects.all().delete()
+            rows = AccessTime.objects.filter(
+                access_time__isnull=False,
+                **{field + '__isnull': False}).annotate(
+                hour=TruncHour('access_time')).values(
+                field + '_id', 'hour').annotate(
+                count=Count('pk'), first_access=Min('access_time'),
+                last_access=Max('access_time')).order_by()
+            created += len(model.objects.bulk_create(
+                (model(**row) for row in rows.iterator()), batch_size=500))
+    return created
+
+
+def get_counts(model, field, start=None, end=None):
+    rollups = model.objects.all()
+    if start is not None:
+        rollups = rollups.filter(hour__gte=truncate_to_hour(start))
+    if end is not None:
+        rollups = rollups.filter(hour__lt=end)
+    return dict(rollups.values_list(field + '_id').annotate(
+        total=Sum('count')).order_by())
+
+
+def get_door_counts(start=None, end=None):
+    """
+    Return a dict of door pk -> number of access times in the hours from
+    start up to end (both optional, and rounded to whole hours), from the
+    rollups.
+    """
+    return get_counts(DoorHourlyAccess, 'door', start, end)
+
+
+def get_lockuser_counts(start=None, end=None):
+    """
+    Like get_door_counts(), per lock user.
+    """
+    return get_counts(LockUserHourlyAccess, 'lockuser', start, end)
@@ -1,9 +1,8 @@
 from django import template
-from django.contrib.admin.sites import AdminSite
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import stringfilter, safe, cut
 from rfid_lock_management.models import LockUser
-from rfid_lock_management.admin import LockUserAdmin
+from rfid_lock_management.door_permissions import get_manageable_doors
 
 register = template.Library()
 
@@ -13,11 +12,10 @@ def get_doors_you_manage(request):
     Give template the list of door names that the staff user can manage,
     or 'None'
     """
-    lua = LockUserAdmin(LockUser, AdminSite())
-    doors_to_show_qs = lua.get_doors_to_show(request)
+    doors = get_manageable_doors(request.user)
     return_val = 'None'  # avoiding a test for 'None'...
-    if doors_to_show_qs:
-        return_val = ', '.join([door.name for door in doors_to_show_qs])
+    if doors:
+        return_val = ', '.join([name for pk, name in doors])
     return return_val
 
 @register.filter
@@ -33,17 +31,13 @@ def fix_json_string(string):
 
 @register.filter
 def does_lockuser_have_active_keycard(object_id):
+    # No lockuser (e.g. on add, when there is no lockuser yet) means no
+    # keycard either.
     try:
-        this_lockuser = LockUser.objects.filter(id=object_id)[0]
-    except:
-        # No lockuser, so no keycard (i.e. can still get behavior we want
-        # on add, when there is no lockuser yet).
+        return LockUser.objects.filter(
+            id=object_id, current_keycard__isnull=False).exists()
+    except (TypeError, ValueError):
         return False
-    if this_lockuser:
-        if this_lockuser.get_current_rfid():
-            return True
-        else:
-            return False
 
 @register.filter
 #def get_object_type(the_object):
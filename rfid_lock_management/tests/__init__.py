@@ -8,3 +8,9 @@ from staff_users_tests import *
 from views_tests import *
 from functional_create_assign_walkthrough import *
 from templatetags_tests import *
+from authorization_tests import *
+from access_log_tests import *
+from charts_tests import *
+from rollups_tests import *
+from query_plan_tests import *
+from door_permissions_tests import *
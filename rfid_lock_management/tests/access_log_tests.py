@@ -0,0 +1,224 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from rfid_lock_management import access_log
+from rfid_lock_management.access_log import AccessTimeWriter, make_event, \
+    make_event_key
+from rfid_lock_management.models import *
+from test_helpers import t_info
+
+
+@override_settings(RFID_ACCESS_LOG_BUFFERED=True)
+class AccessTimeWriterTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase AccessTimeWriterTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.tmp_dir, 'access_log.journal')
+        # flush_interval=0: no background thread, we flush() ourselves
+        self.writer = AccessTimeWriter(journal_path=self.journal_path,
+                                       batch_size=10, flush_interval=0)
+        self.door = Door.objects.create(name='Test door')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.time = datetime.datetime(2013, 5, 16, 15, 30, 20)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record_is_journaled_not_saved(self):
+        """
+        record() only journals and buffers the event
+        """
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        self.assertEqual(self.writer.pending(), 1)
+        self.assertFalse(AccessTime.objects.exists())
+        with open(self.writer.journal_path) as journal:
+            self.assertEqual(json.loads(journal.readline())['the_rfid'],
+                             'abcde12345')
+
+    def test_flush(self):
+        """
+        flush() bulk-saves the buffered events and truncates the journal
+        """
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk,
+                           self.time + datetime.timedelta(minutes=1))
+        # in one transaction (savepoint here): one bulk insert, then for
+        # each rollup an UPDATE, which finds no row for the hour, and an
+        # INSERT (in a savepoint of its own, see rollups.add_to_rollup()),
+        # and the lockuser's last access UPDATE -- 6 queries, 8 savepoint
+        # statements
+        with self.assertNumQueries(14):
+            self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(os.path.getsize(self.writer.journal_path), 0)
+
+        access_times = AccessTime.objects.order_by('access_time')
+        self.assertEqual(len(access_times), 2)
+        self.assertEqual(access_times[0].access_time, self.time)
+        self.assertEqual(access_times[0].lockuser, self.lu)
+        self.assertEqual(access_times[0].door, self.door)
+        lu = LockUser.objects.get(pk=self.lu.pk)
+        self.assertEqual(lu.last_access_time, access_times[1].access_time)
+        self.assertEqual(lu.last_access_door, self.door)
+
+    def test_denied_not_saved(self):
+        """
+        Denied swipes are not queued for the database
+        """
+        self.writer.record('abcde12345', self.door.pk, None, self.time,
+                           granted=False)
+        self.assertEqual(self.writer.pending(), 0)
+
+    def test_recover_from_journal(self):
+        """
+        Events journaled by a process that's gone are written on the next
+        flush of another one
+        """
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        t_info("'Crash' (give up the journal without flushing), then start a "
+               "new writer", 3)
+        self.writer.close()
+        new_writer = AccessTimeWriter(journal_path=self.journal_path,
+                                      flush_interval=0)
+        self.assertEqual(new_writer.pending(), 1)
+        new_writer.flush()
+        self.assertEqual(AccessTime.objects.get().access_time, self.time)
+
+        t_info("The orphaned journal is gone, nothing is adopted twice", 3)
+        other_writer = AccessTimeWriter(journal_path=self.journal_path,
+                                        flush_interval=0)
+        self.assertEqual(other_writer.pending(), 0)
+        new_writer.close()
+        other_writer.close()
+        self.assertEqual(os.listdir(self.tmp_dir),
+                         ['access_log.journal.lock'])
+
+    def test_recover_legacy_journal(self):
+        """
+        Events in the single journal used before there was one per process
+        are picked up too
+        """
+        with open(self.journal_path, 'w') as journal:
+            journal.write(json.dumps(make_event(
+                'abcde12345', self.door.pk, self.lu.pk, self.time)) + '\n')
+        self.assertEqual(self.writer.pending(), 1)
+        self.assertFalse(os.path.exists(self.journal_path))
+
+    def test_journal_closed_while_adopting(self):
+        """
+        A journal whose writer removes it between finding and opening it is
+        skipped
+        """
+        orphan_path = self.journal_path + '.99999-deadbeef'
+        with open(orphan_path, 'w') as journal:
+            journal.write(json.dumps(make_event(
+                'abcde12345', self.door.pk, self.lu.pk, self.time)) + '\n')
+
+        def glob_then_close(pattern):
+            paths = glob(pattern)
+            # the writer's close(), after the glob
+            os.remove(orphan_path)
+            return paths
+        glob = access_log.glob.glob
+        access_log.glob.glob = glob_then_close
+        try:
+            self.assertEqual(self.writer.pending(), 0)
+        finally:
+            access_log.glob.glob = glob
+        self.assertFalse(os.path.exists(orphan_path + '.lock'))
+
+    def test_writers_keep_own_journals(self):
+        """
+        Writers that are running (e.g. other server processes) neither adopt
+        nor overwrite each other's journaled events
+        """
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        other_writer = AccessTimeWriter(journal_path=self.journal_path,
+                                        flush_interval=0)
+        other_writer.record('abcde12345', self.door.pk, self.lu.pk,
+                            self.time + datetime.timedelta(minutes=1))
+        self.assertEqual(other_writer.pending(), 1)
+        other_writer.flush()
+        self.assertEqual(self.writer.pending(), 1)
+        with open(self.writer.journal_path) as journal:
+            self.assertEqual(len(journal.readlines()), 1)
+        other_writer.close()
+        self.writer.flush()
+        self.assertEqual(AccessTime.objects.count(), 2)
+
+    def test_duplicate_event_keys_saved_once(self):
+        """
+        Events with an event_key that's been saved (or queued in the same
+        batch) are skipped
+        """
+        key = make_event_key(self.door.pk, 'abcde12345', 1368736220, 7)
+        for i in range(2):
+            self.writer.record('abcde12345', self.door.pk, self.lu.pk,
+                               self.time, event_key=key)
+        self.writer.flush()
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time,
+                           event_key=key)
+        self.writer.flush()
+        self.assertEqual(AccessTime.objects.get().event_key, key)
+
+
+# (SQLite checks foreign keys when the outermost transaction commits, which
+# TestCase's transaction never does)
+@override_settings(RFID_ACCESS_LOG_BUFFERED=True)
+class AccessTimeWriterDeadLetterTests(TransactionTestCase):
+
+    def setUp(self):
+        t_info("TestCase AccessTimeWriterDeadLetterTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.tmp_dir, 'access_log.journal')
+        self.writer = AccessTimeWriter(journal_path=self.journal_path,
+                                       batch_size=10, flush_interval=0)
+        self.door = Door.objects.create(name='Test door')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.time = datetime.datetime(2013, 5, 16, 15, 30, 20)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dead_letters(self):
+        """
+        An event that can't be saved goes to the dead letter file instead of
+        holding up the others
+        """
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        self.writer.record('abcde12345', self.door.pk + 100, self.lu.pk,
+                           self.time)
+        self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(AccessTime.objects.get().door, self.door)
+        with open(self.journal_path + '.dead') as dead_letters:
+            dead_letter = json.loads(dead_letters.readline())
+        self.assertEqual(dead_letter['door_id'], self.door.pk + 100)
+        self.assertIn('error', dead_letter)
+
+    def test_dead_letters_with_event_key(self):
+        """
+        An event with an event_key that can't be saved for another reason
+        than its key is dead-lettered, not taken for a duplicate
+        """
+        key = make_event_key(self.door.pk + 100, 'abcde12345', 1368736220)
+        self.writer.record('abcde12345', self.door.pk + 100, self.lu.pk,
+                           self.time, event_key=key)
+        self.writer.record('abcde12345', self.door.pk, self.lu.pk, self.time)
+        self.writer.flush()
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertEqual(AccessTime.objects.get().door, self.door)
+        with open(self.journal_path + '.dead') as dead_letters:
+            self.assertEqual(json.loads(dead_letters.readline())['event_key'],
+                             key)
@@ -2,15 +2,22 @@ from django import forms
 
 
 from django.test import TestCase
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
 from django.test.client import Client
 from django.contrib import admin
 from django.forms import CheckboxSelectMultiple, ModelForm
-from django.db import models
-from rfid_lock_management.models import LockUser, AccessTime
-from rfid_lock_management.admin import LockUserAdmin, AccessTimeAdmin
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+import datetime
+import html
+import re
+from rfid_lock_management.models import AccessTime, Door, LockUser, \
+    RFIDkeycard
+from rfid_lock_management.admin import LockUserAdmin, AccessTimeAdmin, \
+    DoorCustomFilter, LockUserCustomFilter
 from django.contrib.admin.sites import AdminSite
 from django.http import HttpResponsePermanentRedirect
+from rfid_lock_management.rollups import rebuild_rollups
 from test_helpers import t_info
 
 
@@ -47,6 +54,99 @@ class LockUserAdminActionsTests(TestCase):
         self.assertFalse(LockUser.objects.get(pk=3).is_active())
 
 
+class LockUserAdminChangeListTests(TestCase):
+    fixtures = ['initial.json']
+
+    def setUp(self):
+        t_info("TestCase LockUserAdminChangeListTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.client = Client()
+        self.client.login(username='moe', password='moe')
+        # (fixtures are loaded without signals)
+        LockUser.refresh_last_access()
+
+    def test_last_access_column(self):
+        """
+        The last access column comes from the denormalized LockUser fields,
+        without any AccessTime queries
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/lockadmin/rfid_lock_management/lockuser/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([
+            q['sql'] for q in queries.captured_queries
+            if 'rfid_lock_management_accesstime' in q['sql']])
+        for lu in LockUser.objects.exclude(last_access_time=None):
+            self.assertContains(
+                response, lu.prettify_get_last_access_time_and_door())
+
+    def test_no_queries_per_row(self):
+        """
+        The number of queries for the change list doesn't depend on the number
+        of lock users on the page
+        """
+        url = "/lockadmin/rfid_lock_management/lockuser/"
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        num_queries = len(queries)
+
+        t_info("Adding lock users with doors, keycards and access times", 3)
+        moe = User.objects.get(username='moe')
+        doors = list(Door.objects.all())
+        for i in range(5):
+            lu = LockUser.objects.create(
+                first_name='Jane', last_name='Doe %d' % i,
+                email='jdoe%d@gmail.com' % i)
+            lu.doors.set(doors[:2])
+            RFIDkeycard.objects.create(the_rfid='99999999%02d' % i,
+                                       lockuser=lu, assigner=moe)
+            AccessTime.objects.create(the_rfid='99999999%02d' % i, lockuser=lu,
+                                      door=doors[0],
+                                      access_time=datetime.datetime.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Doe 4')
+        self.assertEqual(len(queries), num_queries)
+
+
+class LockUserAdminChangeFormTests(TestCase):
+    fixtures = ['initial.json']
+
+    def setUp(self):
+        t_info("TestCase LockUserAdminChangeFormTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.client = Client()
+        self.client.login(username='moe', password='moe')
+
+    def test_change_form_context(self):
+        """
+        The change form's keycard state and doors the staff user can't manage
+        come from the context
+        """
+        response = self.client.get(
+            "/lockadmin/rfid_lock_management/lockuser/1/change/")
+        self.assertTrue(response.context['lockuser_has_active_keycard'])
+        self.assertEqual(
+            response.context['doors_not_permitted_to_this_staff_user'],
+            set(LockUser.objects.get(pk=1).doors.all()))
+        self.assertContains(response, 'id="add_keycard_button"')
+
+    def test_change_form_queries(self):
+        """
+        Rendering the change form queries the lock user only once, and no
+        content types
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(
+                "/lockadmin/rfid_lock_management/lockuser/1/change/")
+        sqls = [query['sql'] for query in queries]
+        self.assertFalse([sql for sql in sqls
+                          if ' FROM "django_content_type"' in sql])
+        self.assertEqual(len([sql for sql in sqls if sql.startswith(
+            'SELECT "rfid_lock_management_lockuser"."id"')]), 1)
+
+
 class AccessTimeAdminTests(TestCase):
     fixtures = ['initial.json']
 
@@ -93,3 +193,264 @@ class AccessTimeAdminTests(TestCase):
             if lu.get_last_access_time():
                 link = "<a href='../lockuser/%d/'>%s</a>" % (lu.id, lu)
                 self.assertIn(link, response.content)
+
+    def test_filter_sidebar(self):
+        """
+        The door and lock user filters only list the selected object, not all
+        of them
+        """
+        # (moe can't see access times in this fixture)
+        self.client.force_login(User.objects.get(username='superuser'))
+        url = "/lockadmin/rfid_lock_management/accesstime/"
+        response = self.client.get(url)
+        self.assertContains(response, 'id="autocomplete_lockuser"')
+        self.assertContains(response, 'id="autocomplete_door"')
+        self.assertNotContains(response, 'Homer Simpson</a>')
+
+        homer = LockUser.objects.get(first_name='Homer')
+        response = self.client.get(url, {'lockuser__id__exact': homer.pk})
+        self.assertContains(response, 'title="Homer Simpson"')
+        self.assertNotContains(response, 'title="Lisa Simpson"')
+
+    def test_filter_search(self):
+        """
+        The filters' search endpoint returns a page of matching objects in
+        name order
+        """
+        # (moe can't see access times in this fixture)
+        self.client.force_login(User.objects.get(username='superuser'))
+        url = "/lockadmin/rfid_lock_management/accesstime/filter_search/%s/"
+        response = self.client.get(url % 'lockuser', {'term': 'simp'})
+        names = [result['text'] for result in response.json()['results']]
+        self.assertEqual(names, ['Homer Simpson', 'Lisa Simpson'])
+        self.assertIsNone(response.json()['next'])
+
+        t_info("Every word has to match", 4)
+        response = self.client.get(url % 'lockuser', {'term': 'simpson l'})
+        self.assertEqual(response.json()['results'],
+                         [{'id': LockUser.objects.get(first_name='Lisa').pk,
+                           'text': 'Lisa Simpson'}])
+
+        t_info("Renamed lock users are found by their new name", 4)
+        lisa = LockUser.objects.get(first_name='Lisa')
+        lisa.last_name = 'Van Houten'
+        lisa.save(update_fields=['last_name'])
+        response = self.client.get(url % 'lockuser', {'term': 'VAN'})
+        self.assertEqual(response.json()['results'],
+                         [{'id': lisa.pk, 'text': 'Lisa Van Houten'}])
+
+        t_info("Doors", 4)
+        response = self.client.get(url % 'door', {'term': 'sem'})
+        self.assertEqual([result['text'] for result in
+                          response.json()['results']], ['Seminar Room'])
+
+        t_info("Unknown filter", 4)
+        response = self.client.get(url % 'accesstime', {'term': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_filter_search_pages(self):
+        """
+        The search is paged by keyset, with a page_size + 1 row query
+        """
+        for i in range(5):
+            LockUser.objects.create(first_name='Bart', last_name='Simpson %d' % i,
+                                    email='bart%d@simpsons.com' % i)
+        # same name: ordered by pk
+        LockUser.objects.create(first_name='Bart', last_name='Simpson 1',
+                                email='bart5@simpsons.com')
+        results, after = LockUserCustomFilter.search('bart', page_size=2)
+        self.assertEqual([text for pk, text in results],
+                         ['Bart Simpson 0', 'Bart Simpson 1'])
+        texts = [text for pk, text in results]
+        pks = [pk for pk, text in results]
+        while after:
+            with CaptureQueriesContext(connection) as queries:
+                results, after = LockUserCustomFilter.search(
+                    'bart', after, page_size=2)
+            self.assertEqual(len(queries), 1)
+            self.assertIn('LIMIT 3', queries[0]['sql'])
+            self.assertNotIn('OFFSET', queries[0]['sql'])
+            texts.extend(text for pk, text in results)
+            pks.extend(pk for pk, text in results)
+        self.assertEqual(texts, ['Bart Simpson 0', 'Bart Simpson 1',
+                                 'Bart Simpson 1', 'Bart Simpson 2',
+                                 'Bart Simpson 3', 'Bart Simpson 4'])
+        self.assertEqual(len(set(pks)), 6)
+
+        t_info("Through the search endpoint", 4)
+        self.client.force_login(User.objects.get(username='superuser'))
+        url = "/lockadmin/rfid_lock_management/accesstime/filter_search/" \
+            "lockuser/"
+        response = self.client.get(url, {'term': 'bart'})
+        self.assertEqual(len(response.json()['results']), 6)
+        response = self.client.get(url, {'term': 'bart', 'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_search_default(self):
+        """
+        By default, the first label field has to start with the term
+        """
+        self.assertEqual([text for pk, text in DoorCustomFilter.search(
+            ' sem')[0]], ['Seminar Room'])
+
+class AccessTimeChangeListTests(TestCase):
+    fixtures = ['initial.json']
+
+    def setUp(self):
+        t_info("TestCase AccessTimeChangeListTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.client = Client()
+        # (moe can't see access times in this fixture)
+        self.client.force_login(User.objects.get(username='superuser'))
+        self.url = "/lockadmin/rfid_lock_management/accesstime/"
+
+    def test_keyset_pages(self):
+        """
+        Paging through the access times newest first by cursor, without
+        OFFSET, and with ties on access_time broken by pk
+        """
+        lu = LockUser.objects.get(pk=1)
+        door = Door.objects.get(pk=1)
+        same_time = datetime.datetime(2013, 5, 1, 12, 0)
+        AccessTime.objects.bulk_create([
+            AccessTime(the_rfid='1111111111', lockuser=lu, door=door,
+                       access_time=same_time) for i in range(150)])
+
+        seen = []
+        response = self.client.get(self.url)
+        while True:
+            cl = response.context['cl']
+            self.assertLessEqual(len(cl.result_list), cl.list_per_page)
+            seen.extend(at.pk for at in cl.result_list)
+            if not cl.older_url:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url + cl.older_url)
+            self.assertTrue(response.context['cl'].newest_url)
+            self.assertFalse([query['sql'] for query in queries
+                              if 'OFFSET' in query['sql']])
+        self.assertEqual(seen, list(AccessTime.objects.order_by(
+            '-access_time', '-pk').values_list('pk', flat=True)))
+
+    def test_links_from_older_page(self):
+        """
+        The date hierarchy and filter links of an older page lead back to the
+        newest matching access times, not past the cursor
+        """
+        lu = LockUser.objects.get(pk=1)
+        door = Door.objects.get(pk=1)
+        response = self.client.get(self.url)
+        AccessTime.objects.bulk_create(
+            [AccessTime(the_rfid='1111111111', lockuser=lu, door=door,
+                        access_time=datetime.datetime(2015, 1, 1))
+             for i in range(5)] +
+            [AccessTime(the_rfid='1111111111', lockuser=lu, door=door,
+                        access_time=datetime.datetime(2014, 1, 1))
+             for i in range(response.context['cl'].list_per_page)])
+        response = self.client.get(self.url)
+        response = self.client.get(self.url + response.context['cl'].older_url)
+        cl = response.context['cl']
+        self.assertTrue(cl.newest_url)
+        self.assertNotIn('after=', cl.get_query_string(
+            {'door__id__exact': door.pk}))
+
+        year_links = [html.unescape(link) for link in re.findall(
+            r'href="(\?[^"]*access_time__year=2015[^"]*)"',
+            response.content.decode())]
+        self.assertTrue(year_links)
+        for link in year_links:
+            self.assertNotIn('after=', link)
+        cl = self.client.get(self.url + year_links[0]).context['cl']
+        self.assertEqual(len(cl.result_list), 5)
+
+    def test_bad_cursor(self):
+        """
+        An invalid cursor redirects to the change list with the error flag
+        """
+        response = self.client.get(self.url, {'after': 'nonsense'})
+        self.assertRedirects(response, self.url + '?e=1',
+                             fetch_redirect_response=False)
+
+    def test_estimated_count(self):
+        """
+        The number of access times comes from the rollups, unless both a door
+        and a lock user are selected
+        """
+        rebuild_rollups()
+        lu = LockUser.objects.get(pk=1)
+        door = Door.objects.get(pk=1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        cl = response.context['cl']
+        self.assertTrue(cl.result_count_is_estimate)
+        self.assertEqual(cl.result_count, AccessTime.objects.count())
+        self.assertFalse([query['sql'] for query in queries
+                          if 'COUNT(' in query['sql'] and
+                          'FROM "rfid_lock_management_accesstime"' in
+                          query['sql']])
+        self.assertContains(response, 'about %d access times' %
+                            cl.result_count)
+
+        t_info("By door, lock user and date", 4)
+        for params, access_times in (
+                ({'door__id__exact': door.pk},
+                 AccessTime.objects.filter(door=door)),
+                ({'lockuser__id__exact': lu.pk},
+                 AccessTime.objects.filter(lockuser=lu)),
+                ({'access_time__year': 2013, 'access_time__month': 4},
+                 AccessTime.objects.filter(access_time__year=2013,
+                                           access_time__month=4))):
+            cl = self.client.get(self.url, params).context['cl']
+            self.assertTrue(cl.result_count_is_estimate)
+            self.assertEqual(cl.result_count, access_times.count())
+
+        t_info("Door and lock user: counted", 4)
+        cl = self.client.get(self.url, {'door__id__exact': door.pk,
+                                        'lockuser__id__exact': lu.pk}
+                             ).context['cl']
+        self.assertFalse(cl.result_count_is_estimate)
+        self.assertEqual(cl.result_count, AccessTime.objects.filter(
+            door=door, lockuser=lu).count())
+
+
+class DoorAdminTests(TestCase):
+    fixtures = ['initial.json']
+
+    def setUp(self):
+        t_info("TestCase DoorAdminTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.client = Client()
+        self.door = Door.objects.get(pk=1)
+        self.url = '/lockadmin/rfid_lock_management/door/%d/change/' % \
+            self.door.pk
+
+    def post_change(self, user):
+        return self.client.post(self.url, {
+            'name': self.door.name, 'description': 'Changed',
+            'managers': [user.pk]})
+
+    def test_staff_cannot_change_managers(self):
+        """
+        Staff users who may change doors can't make themselves managers
+        """
+        staff_user = User.objects.create_user('larry', password='larry',
+                                              is_staff=True)
+        staff_user.user_permissions.add(Permission.objects.get(
+            codename='change_door'))
+        self.client.login(username='larry', password='larry')
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'name="managers"')
+        self.post_change(staff_user)
+        self.assertEqual(Door.objects.get(pk=1).description, 'Changed')
+        self.assertFalse(self.door.managers.filter(pk=staff_user.pk).exists())
+
+    def test_superuser_changes_managers(self):
+        """
+        Superusers choose the managers of a door
+        """
+        superuser = User.objects.get(username='superuser')
+        self.client.force_login(superuser)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'name="managers"')
+        self.post_change(superuser)
+        self.assertTrue(self.door.managers.filter(pk=superuser.pk).exists())
@@ -0,0 +1,130 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.test.client import Client
+from django.core.cache import cache
+from rfid_lock_management.authorization import AuthorizationIndex, \
+    authorization_index
+from rfid_lock_management.models import *
+from test_helpers import t_info
+
+
+@override_settings(RFID_ACCESS_LOG_BUFFERED=False)
+class AuthorizationIndexTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase AuthorizationIndexTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        # don't let an index built for a previous test leak into this one
+        authorization_index.invalidate()
+        self.client = Client()
+        self.staff_only_user = User.objects.create_user(
+            'johnny_staff', 'js@jmail.com', 'my_password')
+        self.door1 = Door.objects.create(name='Allowed door')
+        self.door2 = Door.objects.create(name='Prohibited door')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.lu.doors.set([self.door1])
+        self.rk = RFIDkeycard.objects.create(
+            the_rfid='abcde12345', lockuser=self.lu,
+            assigner=self.staff_only_user)
+
+    def test_get_lockuser_id(self):
+        """
+        Active keycard is allowed through its lockuser's doors only
+        """
+        self.assertEqual(
+            authorization_index.get_lockuser_id('abcde12345', self.door1.pk),
+            self.lu.pk)
+        self.assertIsNone(
+            authorization_index.get_lockuser_id('abcde12345', self.door2.pk))
+        self.assertIsNone(
+            authorization_index.get_lockuser_id('9999999999', self.door1.pk))
+
+    def test_invalidated_on_keycard_deactivation(self):
+        """
+        Revoking the keycard takes effect on the very next lookup
+        """
+        self.assertTrue(
+            authorization_index.get_lockuser_id('abcde12345', self.door1.pk))
+        t_info("Deactivating keycard......", 3)
+        self.rk.deactivate(self.staff_only_user)
+        self.rk.save()
+        self.assertIsNone(
+            authorization_index.get_lockuser_id('abcde12345', self.door1.pk))
+
+    def test_invalidated_in_other_processes(self):
+        """
+        Another process's index (with its own, unshared cache) is rebuilt
+        after a change made in this one
+        """
+        other_index = AuthorizationIndex()
+        self.assertTrue(
+            other_index.get_lockuser_id('abcde12345', self.door1.pk))
+        t_info("Deactivating keycard......", 3)
+        self.rk.deactivate(self.staff_only_user)
+        self.rk.save()
+        cache.clear()
+        self.assertIsNone(
+            other_index.get_lockuser_id('abcde12345', self.door1.pk))
+
+    def test_generation_never_repeats(self):
+        """
+        A rolled back invalidation doesn't leave a generation that a later
+        one can reuse
+        """
+        tokens = set([Generation.get_token('authorization')])
+        for i in range(3):
+            try:
+                with transaction.atomic():
+                    authorization_index.invalidate()
+                    tokens.add(Generation.get_token('authorization'))
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+            authorization_index.invalidate()
+            tokens.add(Generation.get_token('authorization'))
+        self.assertEqual(len(tokens), 7)
+
+    def test_invalidated_on_doors_change(self):
+        """
+        Changing a lockuser's doors takes effect on the very next lookup
+        """
+        self.assertIsNone(
+            authorization_index.get_lockuser_id('abcde12345', self.door2.pk))
+        t_info("Allowing second door......", 3)
+        self.lu.doors.add(self.door2)
+        self.assertEqual(
+            authorization_index.get_lockuser_id('abcde12345', self.door2.pk),
+            self.lu.pk)
+        t_info("Removing first door......", 3)
+        self.lu.doors.remove(self.door1)
+        self.assertIsNone(
+            authorization_index.get_lockuser_id('abcde12345', self.door1.pk))
+
+    def test_get_waiting_scan_pk(self):
+        """
+        Only the latest NewKeycardScan, and only while it's waiting for a scan
+        """
+        self.assertIsNone(authorization_index.get_waiting_scan_pk())
+        nks = NewKeycardScan.objects.create(
+            assigner_user=self.staff_only_user, waiting_for_scan=True)
+        self.assertEqual(authorization_index.get_waiting_scan_pk(), nks.pk)
+        nks.waiting_for_scan = False
+        nks.save()
+        self.assertIsNone(authorization_index.get_waiting_scan_pk())
+
+    def test_check_uses_index(self):
+        """
+        check() authenticates from the index without keycard/door queries
+        """
+        # build the index first
+        authorization_index.get_waiting_scan_pk()
+        url = '/checkdoor/%d/checkrfid/abcde12345/' % self.door1.pk
+        # the authorization generation (twice: scan, then lookup), and the
+        # AccessTime insert only, i.e. the write in its transaction (see
+        # AccessTimeWriterTests.test_flush): 2 + 14
+        with self.assertNumQueries(16):
+            response = self.client.get(url)
+        self.assertEqual(response.content, b'1')
+        self.assertEqual(AccessTime.objects.filter(lockuser=self.lu).count(), 1)
@@ -0,0 +1,191 @@
+import datetime
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rfid_lock_management import charts
+from rfid_lock_management.charts import bin_access_times, \
+    get_chart_coordinates, get_chart_data, get_initial_window
+from rfid_lock_management.models import *
+from test_helpers import t_info
+
+
+class ChartCoordinatesTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase ChartCoordinatesTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+
+    def test_get_chart_coordinates(self):
+        """
+        Datetimes are split into date and time of day milliseconds
+        """
+        x, y = get_chart_coordinates([
+            datetime.datetime(2013, 4, 10, 0, 56, 21),
+            datetime.datetime(1970, 1, 2, 12, 0, 0, 500000)])
+        self.assertEqual(x.tolist(), [1365552000000, 86400000])
+        self.assertEqual(y.tolist(), [(56 * 60 + 21) * 1000, 43200500])
+
+    def test_bin_access_times(self):
+        """
+        Access counts are added up per door, per bin of days, per slot of the
+        day
+        """
+        x, y = get_chart_coordinates([
+            datetime.datetime(1970, 1, 1),
+            datetime.datetime(1970, 1, 2),
+            datetime.datetime(1970, 1, 3),
+            datetime.datetime(1970, 1, 1)])
+        counts = bin_access_times(np.array([0, 0, 1, 1]), x,
+                                  np.array([0, 0, 95, 1]),
+                                  np.array([1, 2, 1, 1]), n_doors=2,
+                                  start=0, bin_days=2)
+        self.assertEqual(counts.shape, (2, 2, 96))
+        self.assertEqual(counts[0, 0, 0], 3)
+        self.assertEqual(counts[1, 1, 95], 1)
+        self.assertEqual(counts[1, 0, 1], 1)
+        self.assertEqual(counts.sum(), 5)
+
+
+class ChartDataTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase ChartDataTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.max_points = charts.CHART_MAX_POINTS
+        self.door1 = Door.objects.create(name='Door 1')
+        self.door2 = Door.objects.create(name='Door 2')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.start = datetime.datetime(2013, 5, 16, 15, 30, 20)
+        for i in range(10):
+            AccessTime.objects.create(
+                the_rfid='abcde12345', lockuser=self.lu, door=self.door1,
+                access_time=self.start + datetime.timedelta(days=i))
+
+    def tearDown(self):
+        charts.CHART_MAX_POINTS = self.max_points
+
+    def test_points(self):
+        """
+        Small windows get the raw points
+        """
+        data = get_chart_data()
+        self.assertEqual(data['mode'], 'points')
+        self.assertEqual([series['name'] for series in data['series']],
+                         ['Door 1', 'Door 2'])
+        self.assertEqual(len(data['series'][0]['data']), 10)
+        self.assertEqual(data['series'][0]['data'][0]['user'], 'Jane Doe')
+        self.assertEqual(data['series'][1]['data'], [])
+
+    def test_window(self):
+        """
+        Only access times from start up to end are included
+        """
+        data = get_chart_data(
+            start=self.start + datetime.timedelta(days=2),
+            end=self.start + datetime.timedelta(days=5))
+        self.assertEqual(len(data['series'][0]['data']), 3)
+
+    def test_bins(self):
+        """
+        Large windows get bounded heatmap matrices of counts instead
+        """
+        charts.CHART_MAX_POINTS = 5
+        data = get_chart_data()
+        self.assertEqual(data['mode'], 'bins')
+        self.assertEqual(data['bin_days'], 1)
+        counts = data['series'][0]['counts']
+        self.assertEqual(len(counts), 10)
+        # 15:30 is the 62nd 15 minute slot of the day
+        self.assertEqual([day_counts[62] for day_counts in counts], [1] * 10)
+        self.assertEqual(sum(map(sum, data['series'][1]['counts'])), 0)
+
+    def test_bins_in_database(self):
+        """
+        Binning reads counts per door, day and slot, not the access times
+        """
+        charts.CHART_MAX_POINTS = 5
+        # 15:35:20, in the same slot as 15:30:20, and 15:45:20, in the next
+        for minutes in (5, 15):
+            AccessTime.objects.create(
+                the_rfid='abcde12345', lockuser=self.lu, door=self.door1,
+                access_time=self.start + datetime.timedelta(minutes=minutes))
+        with CaptureQueriesContext(connection) as queries:
+            data = get_chart_data()
+        self.assertIn('GROUP BY', queries.captured_queries[-1]['sql'])
+        self.assertEqual(data['series'][0]['counts'][0][62:64], [2, 1])
+
+    def test_access_times_without_door(self):
+        """
+        Access times without a door are left out, points or bins
+        """
+        AccessTime.objects.create(the_rfid='abcde12345', lockuser=self.lu,
+                                  access_time=self.start)
+        data = get_chart_data()
+        self.assertEqual(sum(len(series['data'])
+                             for series in data['series']), 10)
+        charts.CHART_MAX_POINTS = 5
+        data = get_chart_data()
+        self.assertEqual(sum(sum(map(sum, series['counts']))
+                             for series in data['series']), 10)
+
+    def test_earlier(self):
+        """
+        The last page of a window tells where the latest earlier access times
+        are, if there are any
+        """
+        data = get_chart_data(start=self.start + datetime.timedelta(days=5),
+                              points_only=True)
+        self.assertEqual(data['earlier'], int(get_chart_coordinates(
+            [datetime.datetime(2013, 5, 21)])[0][0]))
+        data = get_chart_data(start=self.start, points_only=True)
+        self.assertIsNone(data['earlier'])
+        data = get_chart_data(door_ids=[self.door2.pk],
+                              start=self.start + datetime.timedelta(days=5))
+        self.assertIsNone(data['earlier'])
+
+    def test_doors(self):
+        """
+        Only the series of the requested doors are included
+        """
+        data = get_chart_data(door_ids=[self.door2.pk])
+        self.assertEqual([series['door_id'] for series in data['series']],
+                         [self.door2.pk])
+        self.assertEqual(data['series'][0]['data'], [])
+
+    def test_pages(self):
+        """
+        Points come in pages of CHART_MAX_POINTS, each with a cursor for the
+        next one
+        """
+        charts.CHART_MAX_POINTS = 4
+        # same time, other door: ordered by door first
+        AccessTime.objects.create(
+            the_rfid='abcde12345', lockuser=self.lu, door=self.door2,
+            access_time=self.start)
+        points = []
+        data = get_chart_data(points_only=True)
+        pages = 1
+        while data['next']:
+            points.extend((series['door_id'], point['x'])
+                          for series in data['series']
+                          for point in series['data'])
+            data = get_chart_data(after=data['next'])
+            pages += 1
+        points.extend((series['door_id'], point['x'])
+                      for series in data['series'] for point in series['data'])
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(points), 11)
+        self.assertEqual(points, sorted(points))
+
+    def test_initial_window(self):
+        """
+        The chart page starts out with the last days up to the latest access
+        time
+        """
+        start, end = get_initial_window()
+        self.assertEqual(end, datetime.datetime(2013, 5, 26))
+        self.assertEqual(end - start,
+                         datetime.timedelta(days=charts.CHART_INITIAL_DAYS))
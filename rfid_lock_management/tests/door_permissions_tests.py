@@ -0,0 +1,145 @@
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from rfid_lock_management.admin import LockUserAdmin
+from rfid_lock_management.door_permissions import get_manageable_door_ids, \
+    get_manageable_doors, query_manageable_door_ids
+from rfid_lock_management.templatetags.custom_filters import \
+    get_doors_you_manage
+from rfid_lock_management.models import *
+from test_helpers import t_info
+
+
+class DoorPermissionsTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase DoorPermissionsTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        cache.clear()
+        self.door1 = Door.objects.create(name='Door 1')
+        self.door2 = Door.objects.create(name='Door 2')
+        self.door3 = Door.objects.create(name='Door 3')
+        self.staff_only_user = User.objects.create_user(
+            'johnny_staff', 'js@jmail.com', 'my_password')
+        self.door1.managers.add(self.staff_only_user)
+        group = Group.objects.create(name='Door 2 managers')
+        self.door2.manager_groups.add(group)
+        self.staff_only_user.groups.add(group)
+        self.request = RequestFactory().get('/lockadmin/')
+        self.request.user = self.staff_only_user
+
+    def test_query_manageable_door_ids(self):
+        """
+        Doors managed directly and through groups, in one query
+        """
+        other_user = User.objects.create_user(
+            'other_staff', 'os@jmail.com', 'my_password')
+        self.door3.managers.add(other_user)
+        with self.assertNumQueries(1):
+            door_ids = query_manageable_door_ids(self.staff_only_user)
+        self.assertEqual(door_ids, set([self.door1.pk, self.door2.pk]))
+
+        t_info("Managing a door both ways counts once", 4)
+        self.door1.manager_groups.add(Group.objects.get(name='Door 2 managers'))
+        self.assertEqual(query_manageable_door_ids(self.staff_only_user),
+                         set([self.door1.pk, self.door2.pk]))
+
+    def test_inactive_user(self):
+        """
+        Inactive users don't manage any doors
+        """
+        self.staff_only_user.is_active = False
+        self.assertEqual(query_manageable_door_ids(self.staff_only_user),
+                         set())
+
+    def test_once_per_request(self):
+        """
+        The doors are only queried once per request
+        """
+        get_manageable_door_ids(self.request)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_manageable_door_ids(self.request),
+                             set([self.door1.pk, self.door2.pk]))
+
+    def test_admin_doors(self):
+        """
+        The LockUser admin's doors to show, and the lock user's doors that are
+        not among them
+        """
+        lua = LockUserAdmin(LockUser, AdminSite())
+        self.assertEqual(set(lua.get_doors_to_show(self.request)),
+                         set([self.door1, self.door2]))
+        lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        lu.doors.set([self.door1, self.door3])
+        self.assertEqual(lua.get_other_doors(self.request, lu.pk),
+                         set([self.door3]))
+
+    def test_navbar_doors_cached(self):
+        """
+        The navbar's "Doors you manage" is cached across requests
+        """
+        self.assertEqual(get_doors_you_manage(self.request), 'Door 1, Door 2')
+        request = RequestFactory().get('/lockadmin/')
+        request.user = User.objects.get(pk=self.staff_only_user.pk)
+        # only the door managers generation token
+        with self.assertNumQueries(1):
+            self.assertEqual(get_doors_you_manage(request), 'Door 1, Door 2')
+
+        t_info("Not for other users", 4)
+        other_user = User.objects.create_user(
+            'other_staff', 'os@jmail.com', 'my_password')
+        self.assertEqual(get_manageable_doors(other_user), [])
+
+    def test_navbar_doors_invalidated(self):
+        """
+        Cached doors are forgotten when doors, their managers or group
+        memberships change
+        """
+        user = self.staff_only_user
+        self.assertEqual(get_manageable_doors(user),
+                         [(self.door1.pk, 'Door 1'), (self.door2.pk, 'Door 2')])
+
+        t_info("Door renamed", 4)
+        self.door1.name = 'Front door'
+        self.door1.save()
+        self.assertEqual(get_manageable_doors(user),
+                         [(self.door1.pk, 'Front door'),
+                          (self.door2.pk, 'Door 2')])
+
+        t_info("Manager added", 4)
+        self.door3.managers.add(user)
+        self.assertEqual(len(get_manageable_doors(user)), 3)
+
+        t_info("Group left", 4)
+        user.groups.clear()
+        self.assertEqual([pk for pk, name in get_manageable_doors(user)],
+                         [self.door1.pk, self.door3.pk])
+
+        t_info("Managing group deleted", 4)
+        group = Group.objects.create(name='Door 3 managers')
+        self.door3.manager_groups.add(group)
+        user.groups.add(group)
+        self.door3.managers.remove(user)
+        self.assertEqual(len(get_manageable_doors(user)), 2)
+        group.delete()
+        self.assertEqual([pk for pk, name in get_manageable_doors(user)],
+                         [self.door1.pk])
+        self.door3.managers.add(user)
+
+        t_info("Door deleted", 4)
+        self.door3.delete()
+        self.assertEqual(get_manageable_doors(user),
+                         [(self.door1.pk, 'Front door')])
+
+        t_info("Changed in another process (with a cache of its own)", 4)
+        cached_doors = get_manageable_doors(user)
+        Door.managers.through.objects.filter(user=user).delete()
+        Generation.bump('door_managers')
+        self.assertNotEqual(get_manageable_doors(user), cached_doors)
+
+        t_info("Made superuser", 4)
+        user.is_superuser = True
+        self.assertEqual(len(get_manageable_doors(user)), 2)
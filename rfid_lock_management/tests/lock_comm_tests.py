@@ -1,16 +1,31 @@
+import datetime
 import simplejson
+import struct
+import time
+import zlib
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.test.client import Client
-from rfid_lock_management.models import NewKeycardScan, AccessTime
-from test_helpers import t_info
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from rfid_lock_management.models import NewKeycardScan, AccessTime, Door, LockUser, \
+    RFIDkeycard
+from test_helpers import get_content, t_info
 
 
+# write AccessTimes right away rather than from the write-behind thread
+@override_settings(RFID_ACCESS_LOG_BUFFERED=False)
 class LockCommunicationTests(TestCase):
     fixtures = ['initial.json']
 
     def setUp(self):
         self.client = Client()
+        # cached allowlists are keyed on door pk and version only
+        cache.clear()
         t_info("TestCase LockCommunicationTests", 1)
         t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
 
@@ -109,7 +124,7 @@ class LockCommunicationTests(TestCase):
         response = self.client.get('/door/1/getallowed/')
 
         # verify there is a null terminator at the end of the response string
-        actual_rfids = response.content
+        actual_rfids = get_content(response)
         self.assertEqual('\0', actual_rfids[-1:])
 
     def test_all_allowed_existing_door(self):
@@ -118,7 +133,7 @@ class LockCommunicationTests(TestCase):
         self.assertEqual(response.status_code, 200)
 
         # grab the rfids from actual, removing the null terminator
-        actual_rfids = response.content
+        actual_rfids = get_content(response)
         actual_rfids = actual_rfids[:-1]
         actual_rfids_sorted_list = sorted(actual_rfids.split())
         actual_rfids_as_string = ' '.join(actual_rfids_sorted_list)
@@ -129,6 +144,21 @@ class LockCommunicationTests(TestCase):
         #self.assertEqual(response.content,
         #    '{"doorid": 2, "allowed_rfids": ["1122135199", "9999999992"]}')
 
+    def test_all_allowed_not_streamed(self):
+        """ the full list is one plain response, with a Content-Length """
+        response = self.client.get('/door/1/getallowed/')
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Length'],
+                         str(len(response.content)))
+
+    def test_all_allowed_streamed(self):
+        """ ?stream=1 streams the same list from the database """
+        response = self.client.get('/door/1/getallowed/?stream=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(get_content(response), b'1122135122 1122135199\0')
+
     def test_all_allowed_inactive_not_allowed(self):
         """ list of allowed RFIDs does not contain any inactive ones """
         response = self.client.get("/door/3/getallowed/")
@@ -136,4 +166,282 @@ class LockCommunicationTests(TestCase):
         #allowed = simplejson.loads(response.content)['allowed_rfids']
         # should not contain the inactive RFID 9999999991
         # remove null terminator
-        self.assertNotIn('9999999991', response.content[-1:])
+        self.assertNotIn('9999999991', get_content(response)[-1:])
+
+    #
+    #  test_conditional_get* tests: don't download unchanged allowlists
+    #
+    def test_conditional_get_etag(self):
+        """ unchanged allowlist is not sent again for a matching ETag """
+        response = self.client.get('/door/1/getallowed/')
+        etag = response['ETag']
+        version = Door.objects.get(pk=1).allowlist_version
+        self.assertEqual(response['X-Allowlist-Version'], str(version))
+
+        response = self.client.get('/door/1/getallowed/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        t_info("Allowing another door changes the list and the ETag", 3)
+        LockUser.objects.get(pk=3).doors.add(1)
+        response = self.client.get('/door/1/getallowed/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_since(self):
+        """ ?since=<current version> only gets the 'unchanged' marker """
+        version = Door.objects.get(pk=1).allowlist_version
+        response = self.client.get('/door/1/getallowed/?since=%d' % version)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_content(response), ('=%d\0' % version).encode())
+
+        t_info("Unknown version gets the current version and full list", 3)
+        response = self.client.get('/door/1/getallowed/?since=%d' %
+                                   (version + 1))
+        self.assertEqual(response.status_code, 200)
+        tokens = get_content(response)[:-1].decode().split()
+        self.assertEqual(tokens[0], '*%d' % version)
+        self.assertEqual(sorted(tokens[1:]), ['1122135122', '1122135199'])
+
+    def test_delta_sync(self):
+        """ ?since=<older version> gets only the changes since then """
+        version = Door.objects.get(pk=1).allowlist_version
+
+        t_info("Revoke one keycard, give another lockuser the door", 3)
+        keycard = RFIDkeycard.objects.get(the_rfid='1122135122')
+        keycard.deactivate(User.objects.get(username='moe'))
+        keycard.save()
+        LockUser.objects.get(pk=3).doors.add(1)
+        new_version = Door.objects.get(pk=1).allowlist_version
+
+        response = self.client.get('/door/1/getallowed/?since=%d' % version)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_content(response),
+                         ('~%d -1122135122 +9999999992\0' %
+                          new_version).encode())
+
+        t_info("Compacted change log: full list instead", 3)
+        call_command('compact_allowlist_changes', keep=1, stdout=StringIO())
+        response = self.client.get('/door/1/getallowed/?since=%d' % version)
+        self.assertEqual(get_content(response),
+                         ('*%d 1122135199 9999999992\0' %
+                          new_version).encode())
+
+    #
+    #  test_packed_allowlist* tests: binary allowlist format
+    #
+    def test_packed_allowlist(self):
+        """ ?format=bin gets header and sorted packed RFIDs """
+        version = Door.objects.get(pk=1).allowlist_version
+        response = self.client.get('/door/1/getallowed/?format=bin')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/octet-stream')
+
+        header_size = struct.calcsize('>4sBBIII')
+        magic, format_version, flags, count, packed_version, crc = \
+            struct.unpack('>4sBBIII', response.content[:header_size])
+        records = response.content[header_size:]
+        self.assertEqual(magic, b'RFAL')
+        self.assertEqual(format_version, 1)
+        self.assertEqual(flags, 0)
+        self.assertEqual(count, 2)
+        self.assertEqual(packed_version, version)
+        self.assertEqual(crc, zlib.crc32(records))
+        self.assertEqual(records, bytes.fromhex('1122135122' '1122135199'))
+
+    def test_packed_allowlist_accept_header_and_since(self):
+        """ Accept header selects the packed format; ?since=<current version>
+        gets only the header, flagged unchanged """
+        version = Door.objects.get(pk=1).allowlist_version
+        response = self.client.get('/door/1/getallowed/?since=%d' % version,
+                                   HTTP_ACCEPT='application/octet-stream')
+        self.assertEqual(response['content-type'], 'application/octet-stream')
+        self.assertEqual(len(response.content), struct.calcsize('>4sBBIII'))
+        self.assertEqual(struct.unpack('>4sBBIII', response.content)[2:4],
+                         (1, 0))
+
+    def test_packed_allowlist_unpackable_rfid(self):
+        """ An allowlist with an RFID that isn't hex is sent as text (the full
+        list, like for ?since=) rather than without that RFID """
+        lu = LockUser.objects.create(first_name='Bart', last_name='Simpson',
+                                     email='bart@simpsons.com')
+        lu.doors.set([Door.objects.get(pk=1)])
+        RFIDkeycard.objects.create(the_rfid='elbarto123', lockuser=lu,
+                                   assigner=User.objects.get(pk=1))
+        version = Door.objects.get(pk=1).allowlist_version
+        response = self.client.get('/door/1/getallowed/?format=bin')
+        self.assertNotEqual(response['content-type'],
+                            'application/octet-stream')
+        self.assertEqual(get_content(response),
+                         b'*%d 1122135122 1122135199 elbarto123\0' % version)
+
+    #
+    #  test_allowlist_chunk* tests: allowlist in chunks
+    #
+    def test_allowlist_chunk(self):
+        """ ?after=&limit= gets version, total and the rfids after that one """
+        version = Door.objects.get(pk=1).allowlist_version
+        response = self.client.get('/door/1/getallowed/?limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_content(response),
+                         ('#%d/2 1122135122\0' % version).encode())
+
+        response = self.client.get(
+            '/door/1/getallowed/?after=1122135122&limit=5&version=%d' %
+            version)
+        self.assertEqual(get_content(response),
+                         ('#%d/2 1122135199\0' % version).encode())
+
+        response = self.client.get(
+            '/door/1/getallowed/?after=1122135199&version=%d' % version)
+        self.assertEqual(get_content(response),
+                         ('#%d/2\0' % version).encode())
+
+    def test_allowlist_chunk_keyset(self):
+        """ a chunk is a range query on the rfid, not an OFFSET """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/door/1/getallowed/?after=1122135122&limit=5')
+        chunk_queries = [query['sql'] for query in queries
+                         if 'LIMIT 5' in query['sql']]
+        self.assertEqual(len(chunk_queries), 1)
+        self.assertIn('"the_rfid" > ', chunk_queries[0])
+        self.assertNotIn('OFFSET', chunk_queries[0])
+
+    def test_allowlist_chunk_version_changed(self):
+        """ list changed between chunks: 409 and the new version """
+        version = Door.objects.get(pk=1).allowlist_version
+        LockUser.objects.get(pk=3).doors.add(1)
+        response = self.client.get(
+            '/door/1/getallowed/?after=1122135122&limit=1&version=%d' %
+            version)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(get_content(response),
+                         ('!%d\0' % (version + 1)).encode())
+
+    def test_allowlist_chunk_bad_request(self):
+        """ limit must be a positive number """
+        response = self.client.get('/door/1/getallowed/?limit=abc')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/door/1/getallowed/?limit=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_allowlists_for_doors(self):
+        """ allowlists of several doors in one response, RFIDs shared """
+        response = self.client.get('/doors/getallowed/?ids=1,2,3,10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/json')
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['rfids'],
+                         ['1122135122', '1122135199', '9999999992'])
+        self.assertEqual(sorted(data['doors']), ['1', '2', '3'])
+        for door_id, rfids in (('1', ['1122135122', '1122135199']),
+                               ('2', ['1122135199', '9999999992']),
+                               ('3', ['1122135199'])):
+            door = data['doors'][door_id]
+            self.assertEqual([data['rfids'][i] for i in door['rfids']], rfids)
+            self.assertEqual(door['version'],
+                             Door.objects.get(pk=door_id).allowlist_version)
+
+    def test_allowlists_for_doors_bad_request(self):
+        """ door ids must be numbers """
+        response = self.client.get('/doors/getallowed/?ids=1,a')
+        self.assertEqual(response.status_code, 400)
+
+    #
+    #  test_check_batch* tests: reconciling offline swipes
+    #
+    def test_check_batch(self):
+        """ batch of offline swipes: logged as the controller decided, the
+        granted ones saved with their original times """
+        swipe_time = datetime.datetime(2013, 5, 16, 15, 30, 20)
+        timestamp = time.mktime(swipe_time.timetuple())
+        len_before = AccessTime.objects.count()
+        body = ('2 9999999992 %d 1\n'     # allowed
+                '2 1122135122 %d 1\n'     # not allowed now, granted offline
+                '2 9999999991 %d 0\n'     # inactive
+                '1 1122135122 %d 0\n') % ((timestamp,) * 4)
+        response = self.client.post('/checkdoor/batch/', body,
+                                    content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        # 4 logged, line 2 would have been denied, line 4 granted
+        self.assertEqual(response.content, b'4 2 4')
+
+        self.assertEqual(AccessTime.objects.count(), len_before + 2)
+        at = AccessTime.objects.get(the_rfid='9999999992', door_id=2,
+                                    access_time=swipe_time)
+        self.assertEqual(at.lockuser_id, 3)
+        at = AccessTime.objects.get(the_rfid='1122135122', door_id=2,
+                                    access_time=swipe_time)
+        self.assertEqual(at.lockuser_id,
+                         RFIDkeycard.objects.get(pk=1).lockuser_id)
+        self.assertFalse(AccessTime.objects.filter(
+            door_id=1, access_time=swipe_time).exists())
+
+    def test_check_batch_revoked_since(self):
+        """ a swipe granted before the keycard was revoked is still logged
+        for its lock user """
+        keycard = RFIDkeycard.objects.get(the_rfid='9999999991')
+        swipe_time = (keycard.date_revoked - datetime.timedelta(
+            seconds=10)).replace(microsecond=0)
+        timestamp = time.mktime(swipe_time.timetuple())
+        response = self.client.post('/checkdoor/batch/',
+                                    '3 9999999991 %d 1\n' % timestamp,
+                                    content_type='text/plain')
+        # (flagged: it wouldn't be granted now)
+        self.assertEqual(response.content, b'1 1')
+        at = AccessTime.objects.get(the_rfid='9999999991',
+                                    access_time=swipe_time)
+        self.assertEqual(at.lockuser_id, keycard.lockuser_id)
+
+    def test_check_batch_unknown_keycard(self):
+        """ an unknown keycard reported as granted is logged, without a lock
+        user, and flagged as a mismatch """
+        with self.assertLogs('rfid_lock_management.views', 'WARNING'):
+            response = self.client.post('/checkdoor/batch/',
+                                        '\n2 9999999992 1368736220 1\n'
+                                        '2 0000000000 1368736220 1\n',
+                                        content_type='text/plain')
+        self.assertEqual(response.content, b'2 3')
+        at = AccessTime.objects.get(the_rfid='0000000000')
+        self.assertIsNone(at.lockuser_id)
+
+    def test_check_batch_malformed(self):
+        """ malformed line: 400, nothing saved """
+        len_before = AccessTime.objects.count()
+        for body in ('2 9999999992 1368736220 1\n2 9999999992 1\n',
+                     '2 9999999992 1368736220 yes\n'):
+            response = self.client.post('/checkdoor/batch/', body,
+                                        content_type='text/plain')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(AccessTime.objects.count(), len_before)
+
+    def test_check_batch_retry(self):
+        """ posting the same batch again doesn't save anything twice """
+        body = '2 9999999992 1368736220 1 1\n2 9999999992 1368736220 1 2\n'
+        len_before = AccessTime.objects.count()
+        for i in range(2):
+            response = self.client.post('/checkdoor/batch/', body,
+                                        content_type='text/plain')
+            self.assertEqual(response.content, b'2')
+            self.assertEqual(AccessTime.objects.count(), len_before + 2)
+
+    def test_authent_rfid_retry(self):
+        """ a retried check with the same ?ts=&seq= is logged once """
+        len_before = AccessTime.objects.count()
+        for i in range(2):
+            response = self.client.get(
+                "/checkdoor/2/checkrfid/9999999992/?ts=1368736220&seq=42")
+            self.assertEqual(response.content, b'1')
+        self.assertEqual(AccessTime.objects.count(), len_before + 1)
+
+    def test_authent_rfid_seq_without_ts(self):
+        """ ?seq= alone doesn't identify a swipe (the controller may have
+        rebooted), so both are logged """
+        len_before = AccessTime.objects.count()
+        for i in range(2):
+            response = self.client.get(
+                "/checkdoor/2/checkrfid/9999999992/?seq=42")
+            self.assertEqual(response.content, b'1')
+        self.assertEqual(AccessTime.objects.count(), len_before + 2)
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.test import TestCase, LiveServerTestCase
 from django.test.client import Client
 from rfid_lock_management.models import *
@@ -22,28 +24,124 @@ class DoorModelTests(TestCase):
         door = Door.objects.create(name='Test door')
         self.assertEqual(unicode(door), 'Test door')
 
-    def test_door_perm_creation(self):
+    def test_door_managers(self):
         """
-        When a new Door is added, create a corresponding Permission (i.e.
-        checking Door's save() method)
+        Staff users and groups managing a Door; adding a Door doesn't create
+        a Permission for it anymore
         """
-        door_name = "Test door"
-        door = Door(name=door_name)
-        # explicitly save()'ing rather than Door.objects.create()
-        door.save()
+        door = Door.objects.create(name="Test door")
+        self.assertFalse(Permission.objects.filter(
+            codename='can_manage_door_%d' % door.pk))
 
-        # now check that both door and associated permission exist
-        d = Door.objects.filter(name=door_name)
-        self.assertTrue(d)
+        user = User.objects.create_user('door_manager', 'dm@jmail.com', 'pw')
+        group = auth_models.Group.objects.create(name='Door managers')
+        door.managers.add(user)
+        door.manager_groups.add(group)
+        self.assertEqual(list(user.managed_doors.all()), [door])
+        self.assertEqual(list(group.managed_doors.all()), [door])
 
-        # note: door_name, not door.name
-        p = Permission.objects.filter(codename='can_manage_door_%d' % door.pk,
-            name='Can manage door to %s' % door_name,
-            content_type=ContentType.objects.get(
-                app_label='rfid_lock_management',
-                model='door'))
-        self.assertTrue(p)
+class DoorAllowlistTests(TestCase):
 
+    def setUp(self):
+        t_info("TestCase DoorAllowlistTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        # cached allowlists are keyed on door pk and version, which a
+        # previous test may have used too
+        cache.clear()
+        self.staff_only_user = User.objects.create_user(
+            'johnny_staff', 'js@jmail.com', 'my_password')
+        self.door = Door.objects.create(name='Test door')
+        self.lu1 = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.lu2 = LockUser.objects.create(
+            first_name='John', last_name='Doe', email='jodoe@gmail.com')
+        self.rk1 = RFIDkeycard.objects.create(
+            the_rfid='2222222222', lockuser=self.lu1,
+            assigner=self.staff_only_user)
+        self.rk2 = RFIDkeycard.objects.create(
+            the_rfid='1111111111', lockuser=self.lu2,
+            assigner=self.staff_only_user)
+        self.lu1.doors.add(self.door)
+        self.lu2.doors.add(self.door)
+
+    def current_door(self):
+        return Door.objects.get(pk=self.door.pk)
+
+    def test_get_allowed_rfids(self):
+        """
+        get_allowed_rfids() returns sorted RFID strings, from one query, then
+        from the cache
+        """
+        door = self.current_door()
+        with self.assertNumQueries(1):
+            self.assertEqual(door.get_allowed_rfids(),
+                             ['1111111111', '2222222222'])
+        with self.assertNumQueries(0):
+            self.assertEqual(door.get_allowed_rfids(),
+                             ['1111111111', '2222222222'])
+
+    def test_version_bumped_on_keycard_deactivation(self):
+        """
+        Revoking a keycard bumps the version, so the old list isn't used
+        """
+        version = self.current_door().allowlist_version
+        self.rk1.deactivate(self.staff_only_user)
+        self.rk1.save()
+        door = self.current_door()
+        self.assertGreater(door.allowlist_version, version)
+        self.assertEqual(door.get_allowed_rfids(), ['1111111111'])
+
+    def test_version_bumped_on_doors_change(self):
+        """
+        Removing a door from a lockuser, or clearing a door's lockusers, bumps
+        the version
+        """
+        version = self.current_door().allowlist_version
+        self.lu2.doors.remove(self.door)
+        door = self.current_door()
+        self.assertGreater(door.allowlist_version, version)
+        self.assertEqual(door.get_allowed_rfids(), ['2222222222'])
+
+        version = door.allowlist_version
+        door.lockuser_set.clear()
+        door = self.current_door()
+        self.assertGreater(door.allowlist_version, version)
+        self.assertEqual(door.get_allowed_rfids(), [])
+
+    def test_version_bumped_on_lockuser_doors_clear(self):
+        """
+        Clearing a lockuser's doors bumps the versions of those doors
+        """
+        version = self.current_door().allowlist_version
+        self.lu1.doors.clear()
+        door = self.current_door()
+        self.assertGreater(door.allowlist_version, version)
+        self.assertEqual(door.get_allowed_rfids(), ['1111111111'])
+
+    def test_get_allowlist_changes(self):
+        """
+        get_allowlist_changes() returns the net changes since a version, or
+        None if the log doesn't go back that far
+        """
+        version = self.current_door().allowlist_version
+        self.rk1.deactivate(self.staff_only_user)
+        self.rk1.save()
+        t_info("Reassign the revoked card to the other lockuser", 3)
+        self.rk2.deactivate(self.staff_only_user)
+        self.rk2.save()
+        RFIDkeycard.objects.create(the_rfid='2222222222', lockuser=self.lu2,
+                                   assigner=self.staff_only_user)
+        door = self.current_door()
+        self.assertEqual(door.get_allowlist_changes(version),
+                         [('1111111111', False), ('2222222222', True)])
+        self.assertEqual(door.get_allowlist_changes(door.allowlist_version),
+                         [])
+        self.assertIsNone(
+            door.get_allowlist_changes(door.allowlist_version + 1))
+
+        t_info("Versions from before the log started", 3)
+        AllowlistChange.objects.filter(version__lte=version + 1).delete()
+        self.assertIsNone(door.get_allowlist_changes(version))
 
 class AccessTimeModelTests(TestCase):
 
@@ -89,6 +187,65 @@ class RFIDkeycardModelTests(TestCase):
             the_rfid='abcde12345', lockuser=lu, assigner=staff_only_user)
         self.assertEqual(unicode(rk), 'abcde12345')
 
+    def test_current_keycard(self):
+        """
+        Is the lockuser's current_keycard set when a keycard is assigned, and
+        cleared when it's revoked?
+        """
+        lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        staff_only_user = User.objects.create_user(
+            'johnny_staff', 'js@jmail.com', 'my_password')
+        rk = RFIDkeycard.objects.create(
+            the_rfid='abcde12345', lockuser=lu, assigner=staff_only_user)
+        self.assertEqual(LockUser.objects.get(pk=lu.pk).current_keycard, rk)
+        self.assertTrue(lu.is_active())
+
+        t_info("Saving a copy of the lockuser from before the keycard", 3)
+        old_lu = LockUser.objects.get(pk=lu.pk)
+        old_lu.current_keycard = None
+        old_lu.save()
+        self.assertEqual(LockUser.objects.get(pk=lu.pk).current_keycard, rk)
+
+        t_info("Revoking the keycard", 3)
+        rk = RFIDkeycard.objects.get(pk=rk.pk)
+        rk.deactivate(staff_only_user)
+        rk.save()
+        lu = LockUser.objects.get(pk=lu.pk)
+        self.assertIsNone(lu.current_keycard)
+        self.assertFalse(lu.is_active())
+
+    def test_one_active_keycard(self):
+        """
+        Is there at most one active keycard per rfid, and per lockuser?
+        """
+        lu1 = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        lu2 = LockUser.objects.create(
+            first_name='John', last_name='Doe', email='jdoe2@gmail.com')
+        staff_only_user = User.objects.create_user(
+            'johnny_staff', 'js@jmail.com', 'my_password')
+        rk = RFIDkeycard.objects.create(
+            the_rfid='abcde12345', lockuser=lu1, assigner=staff_only_user)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                RFIDkeycard.objects.create(
+                    the_rfid='abcde12345', lockuser=lu2,
+                    assigner=staff_only_user)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                RFIDkeycard.objects.create(
+                    the_rfid='1111111111', lockuser=lu1,
+                    assigner=staff_only_user)
+
+        t_info("Once revoked, the rfid can be assigned again", 3)
+        rk.deactivate(staff_only_user)
+        rk.save()
+        RFIDkeycard.objects.create(
+            the_rfid='abcde12345', lockuser=lu2, assigner=staff_only_user)
+        RFIDkeycard.objects.create(
+            the_rfid='1111111111', lockuser=lu1, assigner=staff_only_user)
+
     def test_get_allowed_doors(self):
         """
         Does get_allowed_doors() return the door(s), if any, that the
@@ -491,6 +648,38 @@ class LockUserModelTests(TestCase):
         # and test again
         self.assertEqual(lu1.prettify_get_last_access_time(), None)
 
+    def test_last_access_fields(self):
+        """ Are last_access_time and last_access_door kept up to date as access
+        times are saved and deleted, and recomputed by refresh_last_access()?
+        """
+        lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        door1 = Door.objects.create(name='Door 1')
+        door2 = Door.objects.create(name='Door 2')
+        now = datetime.datetime.now()
+        at1 = AccessTime.objects.create(access_time=now, lockuser=lu,
+                                        door=door1)
+        t_info("An earlier access time saved later doesn't count", 3)
+        AccessTime.objects.create(access_time=now - timedelta(days=1),
+                                  lockuser=lu, door=door2)
+        lu = LockUser.objects.get(pk=lu.pk)
+        self.assertEqual(lu.last_access_time, at1.access_time)
+        self.assertEqual(lu.last_access_door, door1)
+        self.assertEqual(lu.prettify_get_last_access_time_and_door(),
+                         "%s (Door 1)" % now.strftime("%B %d, %Y, %I:%M %p"))
+
+        t_info("Deleting the last one goes back to the one before", 3)
+        at1.delete()
+        lu = LockUser.objects.get(pk=lu.pk)
+        self.assertEqual(lu.last_access_door, door2)
+
+        t_info("Refresh after a bulk update that sent no signals", 3)
+        AccessTime.objects.filter(lockuser=lu).update(door=door1)
+        self.assertEqual(LockUser.refresh_last_access(), 1)
+        lu = LockUser.objects.get(pk=lu.pk)
+        self.assertEqual(lu.last_access_door, door1)
+        self.assertEqual(lu.last_access_time, now - timedelta(days=1))
+
     def test_custom_save_deactivate_keycard(self):
         """
         Check that custom save deactivates current keycard
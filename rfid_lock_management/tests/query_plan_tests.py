@@ -0,0 +1,138 @@
+import datetime
+import re
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from rfid_lock_management.models import *
+from test_helpers import t_info
+
+
+def get_index_name(model, fields):
+    """
+    Name of the index on fields declared in model's Meta.indexes.
+    """
+    for index in model._meta.indexes:
+        if index.fields == fields:
+            return index.name
+    raise ValueError("%s has no index on %s" % (model.__name__, fields))
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Checks the database's query plans, on SQLite and PostgreSQL (other
+    databases skip these tests). The test tables are tiny, so on PostgreSQL
+    sequential scans are disabled, to see which index the planner would use
+    on a big table.
+    """
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("no query plan checks for %s" % connection.vendor)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # (only for this test's transaction)
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def get_plan(self, queryset):
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, model, fields):
+        """
+        Assert that the queryset is run using the index on fields.
+        """
+        plan = self.get_plan(queryset)
+        index_name = get_index_name(model, fields)
+        if connection.vendor == 'sqlite':
+            expected = r'INDEX %s\b' % index_name
+        else:
+            # (an Index Scan, or a Bitmap Index Scan)
+            expected = r'(using|on) %s\b' % index_name
+        self.assertTrue(re.search(expected, plan),
+                        "%s not used:\n%s" % (index_name, plan))
+
+    def assertNoSort(self, queryset):
+        """
+        Assert that the queryset's ordering comes from an index rather than
+        a sort of the matching rows.
+        """
+        plan = self.get_plan(queryset)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+        else:
+            self.assertNotIn('Sort', plan, plan)
+
+
+class AccessTimeQueryPlanTests(QueryPlanTestCase):
+
+    def setUp(self):
+        super(AccessTimeQueryPlanTests, self).setUp()
+        t_info("TestCase AccessTimeQueryPlanTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.door = Door.objects.create(name='Test door')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        AccessTime.objects.create(
+            the_rfid='abcde12345', lockuser=self.lu, door=self.door,
+            access_time=datetime.datetime(2013, 5, 16, 15, 30, 20))
+
+    def test_lockuser_access_times(self):
+        """
+        A lock user's access times, in order (get_all_access_times())
+        """
+        queryset = AccessTime.objects.filter(lockuser=self.lu).order_by(
+            'access_time').values_list('access_time', flat=True)
+        self.assertUsesIndex(queryset, AccessTime, ['lockuser', 'access_time'])
+        self.assertNoSort(queryset)
+
+    def test_lockuser_latest_access_time(self):
+        """
+        A lock user's latest access time (latest('access_time'))
+        """
+        queryset = AccessTime.objects.filter(lockuser=self.lu).order_by(
+            '-access_time')[:1]
+        self.assertUsesIndex(queryset, AccessTime, ['lockuser', 'access_time'])
+        self.assertNoSort(queryset)
+
+    def test_door_window(self):
+        """
+        A door's access times in a time window (chart data)
+        """
+        queryset = AccessTime.objects.filter(
+            door=self.door,
+            access_time__gte=datetime.datetime(2013, 5, 1),
+            access_time__lt=datetime.datetime(2013, 6, 1)).order_by(
+            'door_id', 'access_time')
+        self.assertUsesIndex(queryset, AccessTime, ['door', 'access_time'])
+        self.assertNoSort(queryset)
+
+    def test_date_hierarchy(self):
+        """
+        Access times of one day, across doors (the admin's date hierarchy)
+        """
+        queryset = AccessTime.objects.filter(
+            access_time__gte=datetime.datetime(2013, 5, 16),
+            access_time__lt=datetime.datetime(2013, 5, 17))
+        self.assertUsesIndex(queryset, AccessTime, ['access_time'])
+
+
+class LockUserQueryPlanTests(QueryPlanTestCase):
+
+    def setUp(self):
+        super(LockUserQueryPlanTests, self).setUp()
+        t_info("TestCase LockUserQueryPlanTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+
+    def test_name_search(self):
+        """
+        The lock user filter's name search looks up the first and last name
+        prefixes in their indexes
+        """
+        from rfid_lock_management.admin import LockUserCustomFilter
+        queryset = LockUserCustomFilter.filter_search(
+            LockUser.objects.all(), 'Do')
+        self.assertUsesIndex(queryset, LockUser,
+                             ['last_name_key', 'first_name_key'])
+        self.assertUsesIndex(queryset, LockUser,
+                             ['first_name_key', 'last_name_key'])
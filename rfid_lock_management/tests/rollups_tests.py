@@ -0,0 +1,134 @@
+import datetime
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from rfid_lock_management.access_log import AccessTimeWriter, make_event
+from rfid_lock_management import rollups
+from rfid_lock_management.models import *
+from rfid_lock_management.rollups import get_door_counts, \
+    get_lockuser_counts, rebuild_rollups
+from test_helpers import t_info
+
+
+class RollupsTests(TestCase):
+
+    def setUp(self):
+        t_info("TestCase RollupsTests", 1)
+        t_info(self._testMethodName + ": " + self._testMethodDoc, 2)
+        self.writer = AccessTimeWriter(flush_interval=0)
+        self.door1 = Door.objects.create(name='Door 1')
+        self.door2 = Door.objects.create(name='Door 2')
+        self.lu = LockUser.objects.create(
+            first_name='Jane', last_name='Doe', email='jdoe@gmail.com')
+        self.time = datetime.datetime(2013, 5, 16, 15, 30, 20)
+
+    def write(self, door, minutes):
+        self.writer.write([
+            make_event('abcde12345', door.pk, self.lu.pk,
+                       self.time + datetime.timedelta(minutes=m))
+            for m in minutes])
+
+    def test_updated_on_write(self):
+        """
+        Written access times are counted per door and lockuser, per hour
+        """
+        self.write(self.door1, [0, 10, 40])
+        t_info("Second batch, partly in an hour that's already there", 3)
+        self.write(self.door1, [-5, 20])
+        self.write(self.door2, [0])
+
+        rollup = DoorHourlyAccess.objects.get(
+            door=self.door1, hour=datetime.datetime(2013, 5, 16, 15))
+        self.assertEqual(rollup.count, 4)
+        self.assertEqual(rollup.first_access,
+                         self.time - datetime.timedelta(minutes=5))
+        self.assertEqual(rollup.last_access,
+                         self.time + datetime.timedelta(minutes=20))
+        self.assertEqual(DoorHourlyAccess.objects.get(
+            door=self.door1, hour=datetime.datetime(2013, 5, 16, 16)).count, 1)
+
+        self.assertEqual(get_door_counts(), {self.door1.pk: 5,
+                                             self.door2.pk: 1})
+        self.assertEqual(get_lockuser_counts(), {self.lu.pk: 6})
+        self.assertEqual(
+            get_door_counts(start=datetime.datetime(2013, 5, 16, 16)),
+            {self.door1.pk: 1})
+
+    def test_written_in_one_transaction(self):
+        """
+        If the rollups can't be updated, the access times aren't saved either
+        """
+        def fail(access_times):
+            raise RuntimeError("rollups unavailable")
+        update_rollups = rollups.update_rollups
+        rollups.update_rollups = fail
+        try:
+            with self.assertRaises(RuntimeError):
+                self.write(self.door1, [0])
+        finally:
+            rollups.update_rollups = update_rollups
+        self.assertFalse(AccessTime.objects.exists())
+        self.assertIsNone(LockUser.objects.get(pk=self.lu.pk).last_access_time)
+
+    def test_saved_one_by_one(self):
+        """
+        Access times saved, changed or deleted one by one (e.g. in the admin)
+        are reflected in the rollups
+        """
+        at = AccessTime.objects.create(
+            the_rfid='abcde12345', lockuser=self.lu, door=self.door1,
+            access_time=self.time)
+        self.write(self.door1, [10])
+        self.assertEqual(get_door_counts(), {self.door1.pk: 2})
+        self.assertEqual(get_lockuser_counts(), {self.lu.pk: 2})
+
+        t_info("Moved to another door and hour", 3)
+        at.door = self.door2
+        at.access_time = self.time + datetime.timedelta(hours=2)
+        at.save()
+        self.assertEqual(get_door_counts(), {self.door1.pk: 1,
+                                             self.door2.pk: 1})
+        rollup = DoorHourlyAccess.objects.get(door=self.door1)
+        self.assertEqual(rollup.first_access,
+                         self.time + datetime.timedelta(minutes=10))
+        self.assertEqual(LockUserHourlyAccess.objects.filter(
+            lockuser=self.lu).count(), 2)
+
+        t_info("Deleted", 3)
+        at.delete()
+        self.assertEqual(get_door_counts(), {self.door1.pk: 1})
+        self.assertEqual(get_lockuser_counts(), {self.lu.pk: 1})
+        self.assertFalse(DoorHourlyAccess.objects.filter(
+            door=self.door2).exists())
+
+    def test_rebuild(self):
+        """
+        rebuild_rollups() recomputes the rollups from the AccessTimes
+        """
+        self.write(self.door1, [0, 10, 40])
+        expected = list(DoorHourlyAccess.objects.order_by('hour').values_list(
+            'door', 'hour', 'count', 'first_access', 'last_access'))
+        t_info("Rollups lose track of access times bulk-created directly", 3)
+        AccessTime.objects.bulk_create([AccessTime(
+            the_rfid='abcde12345', lockuser=self.lu, door=self.door2,
+            access_time=self.time)])
+        DoorHourlyAccess.objects.filter(count=1).delete()
+
+        self.assertEqual(rebuild_rollups(), 5)
+        self.assertEqual(
+            list(DoorHourlyAccess.objects.filter(door=self.door1).order_by(
+                'hour').values_list('door', 'hour', 'count', 'first_access',
+                                    'last_access')),
+            expected)
+        self.assertEqual(get_door_counts(), {self.door1.pk: 3,
+                                             self.door2.pk: 1})
+        self.assertEqual(get_lockuser_counts(), {self.lu.pk: 4})
+
+    def test_rebuild_command(self):
+        """
+        The rebuild_access_rollups command reports how many rollups it made
+        """
+        self.write(self.door1, [0])
+        out = StringIO()
+        call_command('rebuild_access_rollups', stdout=out)
+        self.assertIn("Created 2 hourly access rollups.", out.getvalue())
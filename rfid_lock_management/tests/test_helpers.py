@@ -29,3 +29,13 @@ def t_info(mess_str, level=1):
             print(colored("\t" + mess_str, "blue"))
         elif level == 5:
             print(colored("\t\t" + mess_str, "magenta"))
+
+
+def get_content(response):
+    """
+    Content of a response, whether it's streamed (like the allowlists sent to
+    the Arduino) or not.
+    """
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
@@ -1,10 +1,14 @@
+from calendar import timegm
 from datetime import datetime, timedelta
 import simplejson
 from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
 #from django.utils.timezone import utc
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.client import Client
+from rfid_lock_management.charts import get_initial_window
 from rfid_lock_management.views import get_allowed_rfids
 from rfid_lock_management.models import *
 from test_helpers import t_info
@@ -33,14 +37,27 @@ class ChartDataTests(TestCase):
 
         # tooltip hardcoded in view as well
         tooltip = {'followPointer': 'false', 'pointFormat': '"{point.user}"'}
+        # only the last days (up to the latest access time) are in the page
+        start, end = get_initial_window()
         all_doors_series = []
         for door in Door.objects.all():
-            # get the data points for this door
-            at_this_door = AccessTime.objects.filter(door=door)
-            data_points_values_list = at_this_door.values_list('data_point')
-            data = [simplejson.loads(dp[0]) for dp in data_points_values_list]
+            # get the data points for this door: x is the date, y the time
+            # of day, both in milliseconds (as for JavaScript's Date.UTC())
+            at_this_door = AccessTime.objects.filter(
+                door=door, access_time__gte=start,
+                access_time__lt=end).order_by('access_time')
+            data = []
+            for at in at_this_door:
+                day = at.access_time.replace(
+                    hour=0, minute=0, second=0, microsecond=0)
+                data.append({
+                    'x': int(timegm(day.timetuple())) * 1000,
+                    'y': int((at.access_time - day).total_seconds() * 1000),
+                    'user': '"%s %s"' % (at.lockuser.first_name,
+                                         at.lockuser.last_name)})
             # create door series
-            door_series = {'name': '"%s"' % door.name,
+            door_series = {'id': door.pk,
+                           'name': '"%s"' % door.name,
                            'data': data,
                            'tooltip': tooltip}
             # append to list of all door series
@@ -48,9 +65,47 @@ class ChartDataTests(TestCase):
 
         t_info('Check response context for chart_type string', 4)
         # the one we're really interested in
-        self.assertEqual(response.context['chart_data'],
-            simplejson.dumps(all_doors_series, indent=''))
+        self.assertEqual(simplejson.loads(response.context['chart_data']),
+                         all_doors_series)
 
+    def test_chartify_single_query(self):
+        """ Does chartify() get the access times of all doors in one query,
+        without fetching lockusers row by row? """
+        self.client.login(username='moe', password='moe')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/chart/')
+        self.assertEqual(response.status_code, 200)
+        access_time_queries = [
+            q['sql'] for q in queries.captured_queries
+            if 'rfid_lock_management_accesstime' in q['sql']]
+        # the latest access time (for the window), and the points
+        self.assertEqual(len(access_time_queries), 2)
+        lockuser_queries = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('SELECT')
+            and 'FROM "rfid_lock_management_lockuser"' in q['sql']]
+        self.assertEqual(lockuser_queries, [])
+
+    def test_chart_data(self):
+        """ Does chart_data() return JSON chart data for the window? """
+        self.client.login(username='moe', password='moe')
+        response = self.client.get('/chart/data/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/json')
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['mode'], 'points')
+        self.assertEqual(sum(len(series['data']) for series in data['series']),
+                         AccessTime.objects.count())
+
+        t_info('Window with no access times', 4)
+        response = self.client.get('/chart/data/', {'start': 0, 'end': 1000})
+        data = simplejson.loads(response.content)
+        self.assertEqual(sum(len(series['data']) for series in data['series']),
+                         0)
+
+        t_info('Bad window', 4)
+        response = self.client.get('/chart/data/', {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
 
 class NewKeycardScanTests(TestCase):
     def setUp(self):
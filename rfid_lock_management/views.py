@@ -1,13 +1,29 @@
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+    HttpResponseRedirect, StreamingHttpResponse
 from django.template import RequestContext
 from django.shortcuts import render
 import rfid_lock_management.models
 from datetime import datetime
+import itertools
 import json
+import logging
+import struct
+import zlib
 from django.contrib.auth.decorators import login_required
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from rfid_lock_management.misc_helpers import get_arg_default
+from rfid_lock_management.access_log import access_time_writer, make_event, \
+    make_event_key
+from rfid_lock_management.authorization import authorization_index
+from rfid_lock_management.charts import CHART_INITIAL_DAYS, \
+    get_chart_coordinates, get_chart_data, get_initial_window, \
+    make_chart_points, ms_to_datetime, parse_cursor
 from rfid_lock_management.models import *
 
+logger = logging.getLogger(__name__)
+
 
 def do_json_resp(success, message):
     response_data = {'success': success,
@@ -21,116 +37,526 @@ def chartify(request):
     """
     Return data in appropriate format for the HighCharts (JavaScript)
     AccessTime plot.  Creates a series for each door.
+
+    Only the last CHART_INITIAL_DAYS days (up to the latest access time) are
+    put in the page; the page fetches earlier ones from chart_data().
     """
     tooltip_dict = {}
     tooltip_dict['followPointer'] = 'false'
     tooltip_dict['pointFormat'] = '"{point.user}"'
+    start, end = get_initial_window()
+    # One query for the window's access times, ordered by door, grouped into
+    # one series per door in a single pass.
+    access_times = AccessTime.objects.filter(
+        access_time__isnull=False).order_by('door_id', 'access_time')
+    if start is not None:
+        access_times = access_times.filter(access_time__gte=start,
+                                           access_time__lt=end)
+    rows_by_door = itertools.groupby(
+        access_times.values_list(
+            'door_id', 'access_time', 'lockuser__first_name',
+            'lockuser__last_name').iterator(),
+        key=lambda row: row[0])
+    points_by_door = dict(
+        (door_id, make_chart_points([row[1:] for row in rows]))
+        for door_id, rows in rows_by_door)
     all_series = []
-    for door in Door.objects.all():
+    for door_id, door_name in Door.objects.order_by('pk').values_list(
+            'pk', 'name'):
         one_series = {}
-        one_series['name'] = '"%s"' % door.name
+        one_series['id'] = door_id
+        one_series['name'] = '"%s"' % door_name
         one_series['tooltip'] = tooltip_dict
-        this_door_access_times = AccessTime.objects.filter(door=door)
-        one_series['data'] = []
-        for at in this_door_access_times:
-            one_series['data'].append(json.loads(at.data_point))
+        one_series['data'] = points_by_door.get(door_id, [])
         all_series.append(one_series)
-    extra_context = {'chart_data': json.dumps(all_series, indent="")}
+    extra_context = {'chart_data': json.dumps(all_series, indent=""),
+                     'chart_days': CHART_INITIAL_DAYS}
+    if start is not None:
+        # where the page's "earlier" button starts fetching from
+        extra_context['chart_start'] = int(
+            get_chart_coordinates([start])[0][0])
     return render(request, 'chart.html', extra_context)
 
 
+@login_required
+def chart_data(request):
+    """
+    JSON data for the access times chart (see charts.get_chart_data()):
+        ?doors=1,2     only these doors (default: all)
+        ?start=, ?end= the window, as chart coordinates, i.e. milliseconds
+                       since the epoch (both optional)
+        ?points=1      always raw points (paged), never bins
+        ?after=        cursor for the next page of points, from the previous
+                       response's "next"
+    Raw points for small windows, per door heatmap matrices of access counts
+    for large ones.
+    """
+    params = {}
+    for param in ('start', 'end'):
+        if request.GET.get(param):
+            try:
+                params[param] = ms_to_datetime(int(request.GET[param]))
+            except (ValueError, OverflowError):
+                return HttpResponseBadRequest(
+                    "%s must be milliseconds since the epoch" % param)
+    if request.GET.get('doors'):
+        try:
+            params['door_ids'] = [int(door_id) for door_id in
+                                  request.GET['doors'].split(',') if door_id]
+        except ValueError:
+            return HttpResponseBadRequest("doors must be a comma-separated "
+                                          "list of door ids")
+    if request.GET.get('after'):
+        try:
+            parse_cursor(request.GET['after'])
+        except (ValueError, OverflowError):
+            return HttpResponseBadRequest("after must be a cursor from a "
+                                          "previous response")
+        params['after'] = request.GET['after']
+    params['points_only'] = request.GET.get('points') == '1'
+    return HttpResponse(json.dumps(get_chart_data(**params)),
+                        content_type="application/json")
+
+
+# Packed (binary) allowlist format, for controllers that want to keep the list
+# in flash and binary-search it:
+#   header: magic 'RFAL', format version, flags, number of records, allowlist
+#           version, CRC32 of the records (big-endian)
+#   records: the RFIDs, read as 10 hex digits, as 5-byte big-endian integers,
+#           sorted
+PACKED_ALLOWLIST_HEADER = struct.Struct('>4sBBIII')
+PACKED_ALLOWLIST_MAGIC = b'RFAL'
+PACKED_ALLOWLIST_FORMAT_VERSION = 1
+PACKED_ALLOWLIST_UNCHANGED = 0x01   # flag: no records, ?since= is current
+PACKED_RFID_SIZE = 5
+PACKED_ALLOWLIST_CONTENT_TYPE = 'application/octet-stream'
+
+# rfids per chunk of a streamed allowlist response
+ALLOWLIST_STREAM_BATCH_SIZE = 256
+# default ?limit= for get_allowlist_chunk()
+ALLOWLIST_CHUNK_SIZE = 100
+
+
+def wants_packed_allowlist(request):
+    """
+    Packed format is selected by ?format=bin or an Accept header asking for
+    application/octet-stream.
+    """
+    return (request.GET.get('format') == 'bin' or
+            PACKED_ALLOWLIST_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', ''))
+
+
+def is_packable_rfid(rfid):
+    """
+    Whether rfid can be sent in the packed format, i.e. is 10 hex digits.
+    """
+    if len(rfid) != 2 * PACKED_RFID_SIZE:
+        return False
+    try:
+        int(rfid, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def pack_allowlist(rfids, version, unchanged=False):
+    """
+    Return the allowlist in the packed format described above. The RFIDs
+    have to be packable (see is_packable_rfid()).
+    """
+    packed_rfids = set(int(rfid, 16) for rfid in rfids)
+    records = b''.join(number.to_bytes(PACKED_RFID_SIZE, 'big')
+                       for number in sorted(packed_rfids))
+    flags = PACKED_ALLOWLIST_UNCHANGED if unchanged else 0
+    header = PACKED_ALLOWLIST_HEADER.pack(
+        PACKED_ALLOWLIST_MAGIC, PACKED_ALLOWLIST_FORMAT_VERSION, flags,
+        len(packed_rfids), version, zlib.crc32(records) & 0xffffffff)
+    return header + records
+
+
+def make_allowlist_etag(request, doorid, version):
+    # door pk, allowlist version (and representation)
+    etag = '%d-%d' % (int(doorid), version)
+    if wants_packed_allowlist(request):
+        etag += '-bin'
+    return etag
+
+
+def get_allowlist_etag(request, doorid):
+    """
+    ETag for get_allowed_rfids(): the door's allowlist version, which costs
+    one cheap query. None (i.e. no ETag) if the door doesn't exist.
+    """
+    version = Door.objects.filter(pk=doorid).values_list(
+        'allowlist_version', flat=True).first()
+    # so the view doesn't have to look it up again
+    request.allowlist_version = version
+    if version is None:
+        return None
+    return make_allowlist_etag(request, doorid, version)
+
+
+@condition(etag_func=get_allowlist_etag)
 def get_allowed_rfids(request, doorid):
     """
     Returns list of allowed rfid's for the specified door in JSON format
     (update: no, spaces for now)
+
+    Unchanged lists don't need to be downloaded again:
+        - The response has an ETag, and a request with a matching
+          If-None-Match header gets a 304 (see get_allowlist_etag).
+        - Since the Arduino would rather not deal with headers, it can also
+          send the version it has as ?since=<version>. It then gets back
+            '=<version>' if that's still current, or
+            '~<version>' followed by the changes since then, as +rfid
+            (allow) and -rfid (no longer allow), or
+            '*<version>' followed by the full list, if the change log
+            doesn't go back far enough (see AllowlistChange).
+    The version is also sent in the X-Allowlist-Version header.
+
+    With ?format=bin (or Accept: application/octet-stream) the list is sent
+    in a packed binary format instead, see get_packed_allowlist(). With
+    ?after= and/or ?limit= only part of it is sent, see
+    get_allowlist_chunk().
+
+    With ?stream=1 the full list is streamed straight from the database, so
+    big lists are never held in memory, by the server or as one string (the
+    response then has no Content-Length).
     """
-    try:
-        door = Door.objects.get(pk=doorid)
-        allowed_rfids = door.get_allowed_rfids()  # list of Keycard objects
-        alloweds = [keycard_obj.the_rfid for keycard_obj in allowed_rfids]
-    except:  # door may not exist or any other error . . .
-        alloweds = ""   # but still need to respond
+    version = request.allowlist_version
+    since = request.GET.get('since')
+    stream = request.GET.get('stream') == '1'
+    if wants_packed_allowlist(request):
+        return get_packed_allowlist(request, doorid, version, since)
+    if 'after' in request.GET or 'limit' in request.GET:
+        return get_allowlist_chunk(request, doorid)
+    if version is not None and since == str(version):
+        tokens = ['=%d' % version]
+    else:
+        try:
+            door = Door.objects.get(pk=doorid)
+        except:  # door may not exist or any other error . . .
+            return HttpResponse('\0')   # but still need to respond
+        version = door.allowlist_version
+        changes = None
+        if since is not None and since.isdigit():
+            changes = door.get_allowlist_changes(int(since))
+        if changes is not None:
+            tokens = itertools.chain(['~%d' % version], (
+                ('+' if added else '-') + rfid for rfid, added in changes))
+        else:
+            if stream:
+                rfids = door.allowed_rfids_queryset().iterator(
+                    chunk_size=ALLOWLIST_STREAM_BATCH_SIZE)
+            else:
+                rfids = door.get_allowed_rfids()
+            if since is not None:
+                tokens = itertools.chain(['*%d' % version], rfids)
+            else:
+                tokens = rfids
 
     #to_json = {"doorid": int(doorid), "allowed_rfids": alloweds}
     #return HttpResponse(json.dumps(to_json), content_type='application/json')
     # We don't feel like making the arduino parse JSON, so let's just send a list
     # of numbers separated by spaces.
-    return HttpResponse(' '.join(alloweds) + '\0')
+    return make_allowlist_response(request, doorid, version, tokens,
+                                   stream=stream)
 
 
-def check(request, doorid, rfid):
+def stream_allowlist(tokens):
     """
-    In addition to checking whether the given rfid is valid for the given door,
-    this checks whether we're actually trying to assign a new keycard rather
-    than authenticating. If not doing a new keycard scan, create and save an
-    AccessTime.
+    Yield the tokens separated by spaces, and the null terminator, a batch at
+    a time, rather than building one big string.
+    """
+    tokens = iter(tokens)
+    separator = ''
+    while True:
+        batch = list(itertools.islice(tokens, ALLOWLIST_STREAM_BATCH_SIZE))
+        if not batch:
+            break
+        yield separator + ' '.join(batch)
+        separator = ' '
+    yield '\0'
+
+
+def make_allowlist_response(request, doorid, version, tokens, status=200,
+                            stream=False):
+    if stream:
+        response = StreamingHttpResponse(stream_allowlist(tokens),
+                                         status=status)
+    else:
+        response = HttpResponse(' '.join(tokens) + '\0', status=status)
+    response['X-Allowlist-Version'] = version
+    # (in case the list changed since get_allowlist_etag() looked)
+    response['ETag'] = quote_etag(make_allowlist_etag(request, doorid, version))
+    response['Vary'] = 'Accept'
+    return response
+
+
+def get_allowlist_chunk(request, doorid):
     """
-    response = 0
+    One chunk of the (sorted) allowlist, for controllers that can't hold the
+    whole list: ?after=<rfid>&limit=<m>[&version=<v>] gets
 
-    # Is the request actually for new keycard assignment?
-    new_scan_queryset = NewKeycardScan.objects.all()
-    if new_scan_queryset:
-        # Note - getting latest NewKeycardScan object by ordering by the field
-        # time_initiated may not actually return the latest created object if
-        # 'start scan' was hit many times in a row -- even microseconds don't
-        # seem to have sufficient resolution to actually get the latest object.
+        '#<version>/<total number of rfids>' followed by up to m rfids
 
-        # get the latest NewKeycardScan object
-        new_scan = new_scan_queryset.latest("pk")
+    that sort after <rfid> (from the start of the list without ?after=), so
+    the next chunk is the one after the last rfid received. Each chunk is one
+    indexed range query, however far into the list it is.
 
+    Controllers should pass the version they got with the first chunk for the
+    following ones; if the list has changed in the meantime, the response is
+    '!<current version>' with status 409, and they should start over.
+    """
+    after = request.GET.get('after') or None
+    try:
+        limit = int(request.GET.get('limit', ALLOWLIST_CHUNK_SIZE))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return HttpResponseBadRequest('\0')
+    try:
+        door = Door.objects.get(pk=doorid)
+    except Door.DoesNotExist:
+        return HttpResponse('\0')
+    version = door.allowlist_version
+    if request.GET.get('version', str(version)) != str(version):
+        return make_allowlist_response(request, doorid, version,
+                                       ['!%d' % version], status=409)
+    total = door.allowed_rfids_queryset().count()
+    tokens = itertools.chain(
+        ['#%d/%d' % (version, total)],
+        door.allowed_rfids_queryset(after=after)[:limit])
+    return make_allowlist_response(request, doorid, version, tokens)
+
+
+def get_packed_allowlist(request, doorid, version, since):
+    """
+    get_allowed_rfids() in the packed format (see pack_allowlist()): the full
+    list, or just the header with the UNCHANGED flag if ?since=<version> is
+    still current. If the list has RFIDs that can't be packed, it is sent in
+    the text format instead, as '*<version>' followed by the full list.
+    """
+    if version is not None and since == str(version):
+        content = pack_allowlist([], version, unchanged=True)
+    else:
+        try:
+            door = Door.objects.get(pk=doorid)
+        except Door.DoesNotExist:
+            raise Http404("No such door")
+        version = door.allowlist_version
+        rfids = door.get_allowed_rfids()
+        unpackable = [rfid for rfid in rfids if not is_packable_rfid(rfid)]
+        if unpackable:
+            # Leaving them out would lock their users out of the door; send
+            # the full list in the text format instead (as for ?since=, see
+            # get_allowed_rfids()), which the controller can tell by the
+            # Content-Type.
+            logger.error("Door %s's allowlist has RFIDs that can't be packed "
+                         "(%s), sending it as text", doorid,
+                         ', '.join(unpackable))
+            return make_allowlist_response(
+                request, doorid, version,
+                itertools.chain(['*%d' % version], rfids))
+        content = pack_allowlist(rfids, version)
+    response = HttpResponse(content, content_type=PACKED_ALLOWLIST_CONTENT_TYPE)
+    response['X-Allowlist-Version'] = version
+    response['ETag'] = quote_etag(make_allowlist_etag(request, doorid, version))
+    response['Vary'] = 'Accept'
+    return response
+
+
+def get_allowed_rfids_for_doors(request):
+    """
+    Allowlists of several doors in one response, for gateways that sync a
+    whole building: ?ids=1,2,3 gets JSON like
+
+        {"rfids": ["1122135122", "1122135199", ...],
+         "doors": {"1": {"version": 4, "rfids": [0, 1]}, ...}}
+
+    where each door's rfids are indexes into the shared, de-duplicated (and
+    sorted) "rfids" list. Doors that don't exist are left out.
+    """
+    try:
+        door_ids = [int(door_id) for door_id in
+                    request.GET.get('ids', '').split(',') if door_id]
+    except ValueError:
+        return HttpResponseBadRequest("ids must be a comma-separated list of "
+                                      "door ids")
+    # Versions first: if anything changes in between, the lists are newer
+    # than their version, and the gateway will just fetch them again.
+    versions = dict(Door.objects.filter(pk__in=door_ids).values_list(
+        'pk', 'allowlist_version'))
+    allowlists = Door.query_allowlists(versions)
+
+    all_rfids = sorted(set(itertools.chain(*allowlists.values())))
+    rfid_indexes = dict((rfid, i) for i, rfid in enumerate(all_rfids))
+    doors = {}
+    for door_id, version in versions.items():
+        doors[str(door_id)] = {
+            'version': version,
+            'rfids': [rfid_indexes[rfid]
+                      for rfid in allowlists.get(door_id, [])]}
+    response_data = {'rfids': all_rfids, 'doors': doors}
+    return HttpResponse(json.dumps(response_data),
+                        content_type="application/json")
+
+
+def check(request, doorid, rfid):
+    """
+    In addition to checking whether the given rfid is valid for the given door,
+    this checks whether we're actually trying to assign a new keycard rather
+    than authenticating. If not doing a new keycard scan, queue an AccessTime
+    to be saved by the write-behind logger (see access_log.py).
+
+    Controllers that retry on timeouts should send ?ts=<swipe timestamp>
+    (plus ?seq=<swipe sequence number> if two swipes can have the same
+    timestamp), so a retry isn't logged twice. Without ts, swipes aren't
+    deduplicated: a sequence number alone starts over when the controller
+    reboots or wraps around, so it doesn't identify a swipe.
+    """
+    # Is the request actually for new keycard assignment? The authorization
+    # index knows whether the latest NewKeycardScan object is waiting for a
+    # scan, so we only hit the database when it is.
+    # Note - getting latest NewKeycardScan object by ordering by the field
+    # time_initiated may not actually return the latest created object if
+    # 'start scan' was hit many times in a row -- even microseconds don't
+    # seem to have sufficient resolution to actually get the latest object,
+    # so the index goes by pk.
+    waiting_scan_pk = authorization_index.get_waiting_scan_pk()
+    if waiting_scan_pk is not None:
+        new_scan = NewKeycardScan.objects.filter(pk=waiting_scan_pk).first()
         # Issue #e
-        if new_scan.waiting_for_scan:
+        if new_scan and new_scan.waiting_for_scan:
             # record the door the new scan request came from
             new_scan.doorid = doorid
             new_scan.rfid = rfid
             new_scan.save()
-            return HttpResponse(response)
+            return HttpResponse(0)
 
     # Or is the request actually for authenticating an existing keycard for
-    # this door?  Note -- RFIDkeycard.objects.get(the_rfid=rfid) fails if there
-    # is more than one item returned. Only one item would be active.
+    # this door?  The index only contains active keycards, so a revoked or
+    # unknown rfid, or a door the keycard's lockuser may not access, all
+    # result in None.
     # Issue #i
-    rfidkeycards_with_same_rfid = RFIDkeycard.objects.filter(the_rfid=rfid)
-    if not rfidkeycards_with_same_rfid:
-        # no such keycard, so return response of 0
+    lockuser_id = authorization_index.get_lockuser_id(rfid, int(doorid))
+
+    # Controllers that retry can send their swipe timestamp (and sequence
+    # number), so that a retry isn't logged twice.
+    event_key = None
+    if request.GET.get('ts'):
+        event_key = make_event_key(doorid, rfid, request.GET['ts'],
+                                   request.GET.get('seq', ''))
+
+    # Hand the swipe to the write-behind logger, so the lock gets its answer
+    # without waiting for the AccessTime to be written to the database.
+    access_time_writer.record(rfid, doorid, lockuser_id,
+                              datetime.datetime.now(),
+                              granted=lockuser_id is not None,
+                              event_key=event_key)
+    if lockuser_id is None:
         return HttpResponse(0)
-    else:
-        for rfidkeycard in rfidkeycards_with_same_rfid:
-            # Keycard exists, so moving on to check if it's active and get
-            # allowed doors (the latter is called on lockuser, so need to check
-            # if keycard is active first).
-            if rfidkeycard.is_active():
-                for door in rfidkeycard.get_allowed_doors():
-                    if door.id == int(doorid):
-                        # So response will be 1 -- authenticated.
-                        response = 1
-                        
-                        ######################################################
-                        # create the AccessTime for this visit
-                        ######################################################
-                        lockuser = rfidkeycard.lockuser
-                        at = AccessTime(
-                            the_rfid=rfid,
-                            door=door,
-                            lockuser=lockuser,
-                            access_time=datetime.datetime.now()
-                        )
-                        # Now create and assign data point dict to JSONify for
-                        # the access times highchart
-                        x_coord = 'Date.UTC(%d,%d,%d)' % (
-                            at.access_time.year, at.access_time.month-1,
-                            at.access_time.day)
-                        y_coord = 'Date.UTC(0,0,0, %d,%d,%d)' % (
-                            at.access_time.hour, at.access_time.minute,
-                            at.access_time.second)
-                        user_name = '"%s %s"' % (
-                            at.lockuser.first_name, at.lockuser.last_name)
-                        data_point_dict = {
-                            'x': x_coord, 'y': y_coord, 'user': user_name}
-                        at.data_point = json.dumps(data_point_dict)
-                        at.save()
-
-    return HttpResponse(response)
+
+    # So response will be 1 -- authenticated.
+    return HttpResponse(1)
+
+
+def get_keycard_holders(swipes):
+    """
+    For (rfid, access_time) pairs, a dict of (rfid, access_time) -> the pk of
+    the LockUser the keycard was assigned to at that time (leaving out those
+    no keycard was assigned to), in one query.
+    """
+    keycards = {}
+    for the_rfid, lockuser_id, date_created, date_revoked in \
+            RFIDkeycard.objects.filter(
+                the_rfid__in=set(rfid for rfid, access_time in swipes)
+            ).values_list('the_rfid', 'lockuser_id', 'date_created',
+                          'date_revoked'):
+        keycards.setdefault(the_rfid, []).append(
+            (date_created, date_revoked, lockuser_id))
+    holders = {}
+    for rfid, access_time in swipes:
+        for date_created, date_revoked, lockuser_id in keycards.get(rfid, []):
+            if date_created <= access_time and (
+                    date_revoked is None or access_time < date_revoked):
+                holders[(rfid, access_time)] = lockuser_id
+                break
+    return holders
+
+
+@csrf_exempt
+@require_POST
+def check_batch(request):
+    """
+    Log swipes a controller decided on locally while it was offline. The POST
+    body has one swipe per line:
+
+        <doorid> <rfid> <unix timestamp of the swipe> <1 or 0> [<sequence>]
+
+    where 1 or 0 is what the controller decided (access granted or denied).
+    The swipes are logged as decided, with their original times -- the door
+    has opened (or not) already. The granted ones are saved as AccessTimes,
+    of the lock user the keycard was assigned to at the time (or, failing
+    that, the one the authorization index allows in now), in one bulk insert;
+    the denied ones are logged like check()'s.
+
+    Every swipe is also checked against the authorization index, in one
+    pass, and those the server would have decided differently (e.g. the
+    controller's allowlist was out of date, or the keycard has been revoked
+    since) are logged as warnings. The response is the number of swipes
+    logged, followed by the line numbers of those mismatches, separated by
+    spaces (e.g. '4 2 3'). A malformed line gets a 400 and nothing is logged.
+
+    Each swipe gets an event key made from the whole line, so posting the
+    same batch again (e.g. after a timeout) doesn't save anything twice.
+    """
+    swipes = []
+    for line_number, line in enumerate(
+            request.body.decode('ascii', 'replace').splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            fields = line.split()
+            if len(fields) == 4:
+                fields.append('')
+            doorid, rfid, timestamp, granted, sequence = fields
+            if granted not in ('0', '1'):
+                raise ValueError(granted)
+            swipes.append((line_number, int(doorid), rfid,
+                           datetime.datetime.fromtimestamp(float(timestamp)),
+                           granted == '1',
+                           make_event_key(doorid, rfid, timestamp, sequence)))
+        except (ValueError, OverflowError, OSError):
+            return HttpResponseBadRequest(
+                "Line %d is not '<doorid> <rfid> <timestamp> <1 or 0> "
+                "[<sequence>]'" % line_number)
+
+    holders = get_keycard_holders([
+        (rfid, access_time) for line_number, doorid, rfid, access_time,
+        granted, event_key in swipes if granted])
+    events = []
+    mismatches = []
+    for line_number, doorid, rfid, access_time, granted, event_key in swipes:
+        lockuser_id = authorization_index.get_lockuser_id(rfid, doorid)
+        if granted != (lockuser_id is not None):
+            logger.warning("Door %s %s rfid %s offline at %s, which it "
+                           "would not be now", doorid,
+                           "granted" if granted else "denied", rfid,
+                           access_time.isoformat())
+            mismatches.append(line_number)
+        if granted:
+            events.append(make_event(
+                rfid, doorid, holders.get((rfid, access_time), lockuser_id),
+                access_time, event_key))
+        else:
+            access_time_writer.record(rfid, doorid, None, access_time,
+                                      granted=False)
+    if events:
+        # not buffered: the controller may discard the swipes once we answer
+        access_time_writer.write(events)
+    return HttpResponse(' '.join(
+        str(number) for number in [len(swipes)] + mismatches))
 
 
 @login_required
@@ -148,7 +574,7 @@ def initiate_new_keycard_scan(request, lockuser_object_id):
         # exist, but send this response on ANY type of exception.
         return do_json_resp(False, "This lock user was probably not found in the system.")
 
-    if lu.get_current_rfid():
+    if lu.is_active():
         return do_json_resp(False, "This lock user is already assigned a keycard.")
     else:
         n = NewKeycardScan()